@@ -1,13 +1,53 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Dict, Union, Optional
+from typing import List, Dict, Union, Optional, Iterator, Tuple, Callable
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from anyio import to_thread
+from .db import GitDatabase
 from .query import GitQueryService
+import os
+import threading
+import orjson
 import uvicorn
 
+# 提交数量超过该值时分块序列化并流式返回，每块包含的提交数量相同
+STREAM_CHUNK_SIZE = 1000
+
+# 只读接口的响应缓存容量，设为0时关闭缓存
+RESPONSE_CACHE_SIZE = int(os.getenv('API_RESPONSE_CACHE_SIZE', '10000'))
+
+# 缓存键包含仓库版本，同步或删除仓库时递增版本，旧版本的缓存随LRU自然淘汰
+_response_cache: "OrderedDict[Tuple, Dict]" = OrderedDict()
+_repo_versions: Dict[str, int] = {}
+_response_cache_lock = threading.Lock()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期管理"""
+    # 接口均为同步函数，由线程池执行，提高线程池容量以支持更多并发请求
+    to_thread.current_default_thread_limiter().total_tokens = int(
+        os.getenv('API_THREADPOOL_SIZE', '64')
+    )
+
+    # 整个应用共用一个Neo4j驱动及其连接池，数据库约束只在启动时初始化一次
+    app.state.neo4j_driver = GitDatabase.create_driver(
+        uri=os.getenv('NEO4J_URI'),
+        user=os.getenv('NEO4J_USER'),
+        password=os.getenv('NEO4J_PASSWORD'),
+        max_connection_pool_size=int(os.getenv('NEO4J_POOL_SIZE', '64'))
+    )
+    try:
+        yield
+    finally:
+        app.state.neo4j_driver.close()
+
 app = FastAPI(
     title="Git Commit 查询服务",
-    description="用于查询Git仓库中的提交信息"
+    description="用于查询Git仓库中的提交信息",
+    lifespan=lifespan
 )
 
 # 配置 CORS
@@ -19,6 +59,67 @@ app.add_middleware(
     allow_headers=["*"],    # 允许所有请求头
 )
 
+def get_query_service(request: Request) -> Iterator[GitQueryService]:
+    """为每个请求提供查询服务，复用应用启动时创建的Neo4j驱动"""
+    driver = getattr(request.app.state, 'neo4j_driver', None)
+    with GitQueryService(driver=driver) as query_service:
+        yield query_service
+
+def commits_response(commits: List[Dict]) -> Response:
+    """
+    使用 orjson 直接序列化提交列表
+    服务层返回的提交已符合 CommitResponse 结构，返回 Response 可跳过响应模型的逐条校验；
+    提交较多时分块流式返回，不必在内存中同时保留完整的序列化结果
+    """
+    if len(commits) <= STREAM_CHUNK_SIZE:
+        return Response(content=orjson.dumps(commits), media_type="application/json")
+    return StreamingResponse(iter_json_array(commits), media_type="application/json")
+
+def commit_response(commit: Dict) -> Response:
+    """使用 orjson 直接序列化单个提交，与提交列表一样跳过响应模型的校验"""
+    return Response(content=orjson.dumps(commit), media_type="application/json")
+
+def iter_json_array(commits: List[Dict]) -> Iterator[bytes]:
+    """将提交列表分块序列化为一个 JSON 数组"""
+    yield b'['
+    for i in range(0, len(commits), STREAM_CHUNK_SIZE):
+        # 去掉每块的方括号，块之间用逗号连接
+        chunk = orjson.dumps(commits[i:i + STREAM_CHUNK_SIZE])[1:-1]
+        yield chunk if i == 0 else b',' + chunk
+    yield b']'
+
+def cached_response(repo_url: str, key: Tuple, loader: Callable[[], Dict]) -> Dict:
+    """
+    从响应缓存中获取结果，未命中时调用 loader 加载并写入缓存
+
+    :param repo_url: 仓库URL
+    :param key: 接口及参数组成的缓存键
+    :param loader: 加载结果的函数，抛出异常时不写入缓存
+    :return: 接口返回结果
+    """
+    if RESPONSE_CACHE_SIZE <= 0:
+        return loader()
+
+    with _response_cache_lock:
+        cache_key = (repo_url, _repo_versions.get(repo_url, 0)) + key
+        result = _response_cache.get(cache_key)
+        if result is not None:
+            _response_cache.move_to_end(cache_key)
+            return result
+
+    result = loader()
+
+    with _response_cache_lock:
+        _response_cache[cache_key] = result
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+    return result
+
+def invalidate_repo_cache(repo_url: str):
+    """使指定仓库的响应缓存失效"""
+    with _response_cache_lock:
+        _repo_versions[repo_url] = _repo_versions.get(repo_url, 0) + 1
+
 class CommitResponse(BaseModel):
     id: str
     message: str
@@ -56,10 +157,11 @@ class DeleteRepositoryResponse(BaseModel):
     responses={400: {"model": ErrorResponse}},
     summary="获取两个引用之间的提交信息"
 )
-async def get_commits_between(
+def get_commits_between(
     repo_url: str,
     start_ref: str,
-    end_ref: str
+    end_ref: str,
+    query_service: GitQueryService = Depends(get_query_service)
 ):
     """
     获取Git仓库中两个引用之间的所有提交信息
@@ -69,9 +171,8 @@ async def get_commits_between(
     - **end_ref**: 结束引用（可以是分支名、tag名或commit id）
     """
     try:
-        with GitQueryService() as query_service:
-            commits = query_service.get_commits_between(repo_url, start_ref, end_ref)
-            return commits
+        commits = query_service.get_commits_between(repo_url, start_ref, end_ref)
+        return commits_response(commits)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -81,7 +182,10 @@ async def get_commits_between(
     responses={400: {"model": ErrorResponse}},
     summary="获取指定深度的提交信息"
 )
-async def get_commits_by_depth(request: CommitDepthRequest):
+def get_commits_by_depth(
+    request: CommitDepthRequest,
+    query_service: GitQueryService = Depends(get_query_service)
+):
     """
     获取Git仓库中从指定引用开始的指定深度的所有提交
 
@@ -90,13 +194,12 @@ async def get_commits_by_depth(request: CommitDepthRequest):
     - **max_depth**: 最大深度，-1表示不限制深度
     """
     try:
-        with GitQueryService() as query_service:
-            commits = query_service.get_commits_by_depth(
-                request.remote_url,
-                request.start_ref,
-                request.max_depth
-            )
-            return commits
+        commits = query_service.get_commits_by_depth(
+            request.remote_url,
+            request.start_ref,
+            request.max_depth
+        )
+        return commits_response(commits)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -108,16 +211,22 @@ async def get_commits_by_depth(request: CommitDepthRequest):
     responses={400: {"model": ErrorResponse}},
     summary="获取仓库的第一个提交"
 )
-async def get_first_commit(repo_url: str):
+def get_first_commit(
+    repo_url: str,
+    query_service: GitQueryService = Depends(get_query_service)
+):
     """
     获取Git仓库的第一个提交（最初的提交）
 
     - **repo_url**: Git仓库的URL
     """
     try:
-        with GitQueryService() as query_service:
-            commit = query_service.get_first_commit(repo_url)
-            return commit
+        commit = cached_response(
+            repo_url,
+            ('first',),
+            lambda: query_service.get_first_commit(repo_url)
+        )
+        return commit_response(commit)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -127,9 +236,10 @@ async def get_first_commit(repo_url: str):
     responses={400: {"model": ErrorResponse}},
     summary="获取单个提交信息"
 )
-async def get_commit_by_id(
+def get_commit_by_id(
     commit_id: str,
-    repo_url: str
+    repo_url: str,
+    query_service: GitQueryService = Depends(get_query_service)
 ):
     """
     快速获取Git仓库中指定ID的提交信息
@@ -138,9 +248,9 @@ async def get_commit_by_id(
     - **repo_url**: Git仓库的URL
     """
     try:
-        with GitQueryService() as query_service:
-            commit = query_service.get_commit_by_id(repo_url, commit_id)
-            return commit
+        # 查询服务内部缓存单个提交，这里不再重复缓存
+        commit = query_service.get_commit_by_id(repo_url, commit_id)
+        return commit_response(commit)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -152,7 +262,10 @@ async def get_commit_by_id(
     responses={400: {"model": ErrorResponse}},
     summary="同步提交历史到数据库"
 )
-async def sync_commit_history(request: SyncHistoryRequest):
+def sync_commit_history(
+    request: SyncHistoryRequest,
+    query_service: GitQueryService = Depends(get_query_service)
+):
     """
     同步指定提交ID的上游历史到数据库
 
@@ -161,16 +274,16 @@ async def sync_commit_history(request: SyncHistoryRequest):
     - **batch_size**: 每批获取的提交数量（默认100）
     """
     try:
-        with GitQueryService() as query_service:
-            total_synced = query_service.sync_commit_history(
-                request.repo_url,
-                request.commit_id,
-                request.batch_size
-            )
-            return {
-                "total_synced": total_synced,
-                "message": f"成功同步 {total_synced} 个提交"
-            }
+        total_synced = query_service.sync_commit_history(
+            request.repo_url,
+            request.commit_id,
+            request.batch_size
+        )
+        invalidate_repo_cache(request.repo_url)
+        return {
+            "total_synced": total_synced,
+            "message": f"成功同步 {total_synced} 个提交"
+        }
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -182,16 +295,19 @@ async def sync_commit_history(request: SyncHistoryRequest):
     responses={400: {"model": ErrorResponse}},
     summary="删除仓库的所有信息"
 )
-async def delete_repository(repo_url: str):
+def delete_repository(
+    repo_url: str,
+    query_service: GitQueryService = Depends(get_query_service)
+):
     """
     从数据库中删除指定仓库的所有信息，包括所有提交记录
 
     - **repo_url**: Git仓库的URL
     """
     try:
-        with GitQueryService() as query_service:
-            result = query_service.delete_repository(repo_url)
-            return result
+        result = query_service.delete_repository(repo_url)
+        invalidate_repo_cache(repo_url)
+        return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -1,22 +1,118 @@
-from neo4j import GraphDatabase
-from typing import List, Dict, Union, Optional
+from neo4j import GraphDatabase, Driver, Session
+from neo4j.exceptions import Neo4jError
+from typing import List, Dict, Union, Optional, Set, Iterable, Tuple, ContextManager
+from contextlib import nullcontext
+import atexit
 import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# save_commits 每个事务写入的最大提交数量
+SAVE_BATCH_SIZE = 1000
+
+# 各驱动对应的数据库是否安装了 APOC 插件
+_apoc_available: Dict[int, bool] = {}
+
+# 已初始化约束的数据库URI，约束属于数据库本身，每个进程只需创建一次
+_constraints_initialized: Set[str] = set()
+# 并发的首次请求只由一个线程创建约束，其他线程等待创建完成，避免并发执行DDL产生冲突
+_constraints_lock = threading.Lock()
+
+# 进程内共享的Neo4j驱动，按连接参数区分，进程退出时统一关闭
+_shared_drivers: Dict[Tuple[str, str, str], Driver] = {}
+_shared_drivers_lock = threading.Lock()
+
+def _close_shared_drivers():
+    """关闭所有共享的Neo4j驱动"""
+    with _shared_drivers_lock:
+        for driver in _shared_drivers.values():
+            driver.close()
+        _shared_drivers.clear()
+
+atexit.register(_close_shared_drivers)
 
 class GitDatabase:
-    def __init__(self, uri: str, user: str, password: str):
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        driver: Optional[Driver] = None
+    ):
         """
         初始化Neo4j数据库连接
 
         :param uri: Neo4j数据库URI
         :param user: 用户名
         :param password: 密码
+        :param driver: 共享的Neo4j驱动，提供时直接复用其连接池，关闭时不会关闭该驱动
+        """
+        if driver is None:
+            self._driver = self.create_driver(uri, user, password)
+            self._owns_driver = True
+        else:
+            self._driver = driver
+            self._owns_driver = False
+
+    @classmethod
+    def create_driver(
+        cls,
+        uri: str,
+        user: str,
+        password: str,
+        max_connection_pool_size: int = 100
+    ) -> Driver:
+        """
+        创建Neo4j驱动并初始化数据库约束
+
+        :param uri: Neo4j数据库URI
+        :param user: 用户名
+        :param password: 密码
+        :param max_connection_pool_size: 连接池最大连接数
+        :return: Neo4j驱动
+        """
+        driver = GraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=max_connection_pool_size
+        )
+        with _constraints_lock:
+            if uri not in _constraints_initialized:
+                cls._init_constraints(driver)
+                _constraints_initialized.add(uri)
+        return driver
+
+    @classmethod
+    def get_shared_driver(
+        cls,
+        uri: str,
+        user: str,
+        password: str,
+        max_connection_pool_size: int = 100
+    ) -> Driver:
+        """
+        获取进程内共享的Neo4j驱动，首次调用时创建
+        驱动在进程退出时关闭，调用方不应自行关闭
+
+        :param uri: Neo4j数据库URI
+        :param user: 用户名
+        :param password: 密码
+        :param max_connection_pool_size: 首次创建时连接池的最大连接数
+        :return: Neo4j驱动
         """
-        self._driver = GraphDatabase.driver(uri, auth=(user, password))
-        self._init_constraints()
+        key = (uri, user, password)
+        with _shared_drivers_lock:
+            driver = _shared_drivers.get(key)
+            if driver is None:
+                driver = cls.create_driver(uri, user, password, max_connection_pool_size)
+                _shared_drivers[key] = driver
+        return driver
 
-    def _init_constraints(self):
+    @staticmethod
+    def _init_constraints(driver: Driver):
         """初始化数据库约束"""
-        with self._driver.session() as session:
+        with driver.session() as session:
             # 为Commit节点创建唯一性约束
             session.run("""
                 CREATE CONSTRAINT commit_id IF NOT EXISTS
@@ -30,59 +126,230 @@ class GitDatabase:
             """)
 
     def close(self):
-        """关闭数据库连接"""
-        self._driver.close()
+        """关闭数据库连接，共享的驱动由其创建者负责关闭"""
+        if self._owns_driver:
+            self._driver.close()
+
+    def session(self) -> Session:
+        """
+        打开一个会话，供需要连续执行多次查询的调用方复用
+        会话不是线程安全的，同一时间只能在一个线程中使用
+        """
+        return self._driver.session()
+
+    def _session(self, session: Optional[Session]) -> ContextManager[Session]:
+        """使用调用方提供的会话，未提供时打开新会话并在使用后关闭"""
+        if session is not None:
+            return nullcontext(session)
+        return self._driver.session()
 
-    def save_commits(self, repo_url: str, commits: List[Dict[str, Union[str, int, List[str]]]]):
+    def save_commits(
+        self,
+        repo_url: str,
+        commits: List[Dict[str, Union[str, int, List[str]]]],
+        session: Optional[Session] = None,
+        synced: bool = False
+    ):
         """
         保存提交信息到数据库
+        使用 UNWIND 批量写入，每批一次往返，避免逐条提交的网络开销
 
         :param repo_url: 仓库URL
         :param commits: 提交信息列表
+        :param session: 复用的会话，不提供时打开新会话
+        :param synced: 是否标记为已同步，只在同步历史时设置；
+            查询时保存的单个提交或截断的历史不带标记，其祖先不一定已保存
         """
-        with self._driver.session() as session:
-            # 创建或获取Repository节点
-            session.run("""
-                MERGE (r:Repository {url: $repo_url})
-            """, repo_url=repo_url)
-
-            # 首先创建所有Commit节点
-            for commit in commits:
-                session.run("""
-                    MERGE (c:Commit {id: $commit_id})
-                    ON CREATE SET 
-                        c.message = $message,
-                        c.author = $author,
-                        c.time = $time,
-                        c.depth = $depth
-                    WITH c
-                    MATCH (r:Repository {url: $repo_url})
-                    MERGE (c)-[:BELONGS_TO]->(r)
-                """, {
-                    'repo_url': repo_url,
-                    'commit_id': commit['id'],
-                    'message': commit['message'],
-                    'author': commit['author'],
-                    'time': commit['time'],
-                    'depth': commit['depth']
-                })
-
-            # 然后创建所有父子关系
-            for commit in commits:
-                if commit['parents']:
-                    session.run("""
-                        MATCH (c:Commit {id: $commit_id})
-                        UNWIND $parents as parent_id
-                        MATCH (p:Commit {id: parent_id})
-                        MERGE (c)-[:PARENT]->(p)
-                    """, {
-                        'commit_id': commit['id'],
-                        'parents': commit['parents']
-                    })
+        if not commits:
+            return
+
+        # 提交数量较多时交给 APOC 在服务端分批执行，避免单个事务过大
+        if len(commits) > SAVE_BATCH_SIZE and self._has_apoc():
+            self._save_commits_with_apoc(repo_url, commits, session, synced)
+            return
+
+        with self._session(session) as session:
+            # 每批提交的节点和父子关系在同一个事务中写入，
+            # 尚未写入的父提交会先创建为占位节点，因此批次之间没有顺序依赖
+            for i in range(0, len(commits), SAVE_BATCH_SIZE):
+                session.execute_write(
+                    self._write_commit_batch,
+                    repo_url,
+                    commits[i:i + SAVE_BATCH_SIZE],
+                    synced
+                )
+
+    def _has_apoc(self) -> bool:
+        """检查数据库是否安装了 APOC 插件，结果按驱动缓存"""
+        key = id(self._driver)
+        if key not in _apoc_available:
+            try:
+                with self._driver.session() as session:
+                    record = session.run("""
+                        SHOW PROCEDURES YIELD name
+                        WHERE name = 'apoc.periodic.iterate'
+                        RETURN count(name) > 0 AS available
+                    """).single()
+                    _apoc_available[key] = bool(record and record["available"])
+            except Neo4jError:
+                _apoc_available[key] = False
+            if not _apoc_available[key]:
+                logger.info("未检测到 APOC 插件，使用 UNWIND 批量写入")
+        return _apoc_available[key]
+
+    def _save_commits_with_apoc(
+        self,
+        repo_url: str,
+        commits: List[Dict],
+        session: Optional[Session] = None,
+        synced: bool = False
+    ):
+        """
+        使用 apoc.periodic.iterate 分批写入提交
+
+        节点写入互不冲突，可以并行执行；
+        关系写入都会锁定仓库节点和父提交节点，串行执行以避免死锁
+        """
+        with self._session(session) as session:
+            session.run("MERGE (r:Repository {url: $repo_url})", repo_url=repo_url).consume()
+
+            self._run_periodic_iterate(session, """
+                MERGE (c:Commit {id: commit.id})
+                ON CREATE SET
+                    c.message = commit.message,
+                    c.author = commit.author,
+                    c.time = commit.time,
+                    c.depth = commit.depth
+                ON MATCH SET
+                    c.message = coalesce(c.message, commit.message),
+                    c.author = coalesce(c.author, commit.author),
+                    c.time = coalesce(c.time, commit.time),
+                    c.depth = coalesce(c.depth, commit.depth)
+                SET c.synced = CASE WHEN $synced THEN true ELSE c.synced END
+            """, repo_url, commits, parallel=True, synced=synced)
+
+            self._run_periodic_iterate(session, """
+                MATCH (r:Repository {url: $repo_url})
+                MATCH (c:Commit {id: commit.id})
+                MERGE (c)-[:BELONGS_TO]->(r)
+                WITH c, commit
+                UNWIND commit.parents AS parent_id
+                MERGE (p:Commit {id: parent_id})
+                MERGE (c)-[:PARENT]->(p)
+            """, repo_url, commits, parallel=False)
+
+    @staticmethod
+    def _run_periodic_iterate(
+        session,
+        action: str,
+        repo_url: str,
+        commits: List[Dict],
+        parallel: bool,
+        synced: bool = False
+    ):
+        """执行 apoc.periodic.iterate，有批次失败时抛出异常"""
+        record = session.run("""
+            CALL apoc.periodic.iterate(
+                'UNWIND $commits AS commit RETURN commit',
+                $action,
+                {
+                    batchSize: $batch_size,
+                    parallel: $parallel,
+                    params: {commits: $commits, repo_url: $repo_url, synced: $synced}
+                }
+            )
+            YIELD failedBatches, errorMessages
+            RETURN failedBatches, errorMessages
+        """, {
+            'action': action,
+            'batch_size': SAVE_BATCH_SIZE,
+            'parallel': parallel,
+            'commits': commits,
+            'repo_url': repo_url,
+            'synced': synced
+        }).single()
+
+        if record["failedBatches"]:
+            raise RuntimeError(f"批量写入提交失败: {record['errorMessages']}")
+
+    @classmethod
+    def _write_commit_batch(cls, tx, repo_url: str, commits: List[Dict], synced: bool = False):
+        """在一个事务中写入一批提交的节点和父子关系"""
+        columns = cls._to_columns(commits)
+        cls._merge_commit_nodes(tx, repo_url, columns, synced)
+        cls._merge_parent_edges(tx, columns)
+
+    @staticmethod
+    def _to_columns(commits: List[Dict]) -> Dict[str, List]:
+        """
+        将提交列表转换为按字段分列的参数
+        以列表的列表传给数据库时，字段名只编码一次，不必在每个提交的 map 中重复编码
+        """
+        return {
+            'ids': [commit['id'] for commit in commits],
+            'messages': [commit['message'] for commit in commits],
+            'authors': [commit['author'] for commit in commits],
+            'times': [commit['time'] for commit in commits],
+            'depths': [commit['depth'] for commit in commits],
+            'parents': [commit['parents'] for commit in commits],
+        }
+
+    @staticmethod
+    def _merge_commit_nodes(tx, repo_url: str, columns: Dict[str, List], synced: bool = False):
+        """批量创建Commit节点及其与仓库的关系，已同步的标记一旦设置不再清除"""
+        tx.run("""
+            MERGE (r:Repository {url: $repo_url})
+            WITH r
+            UNWIND range(0, size($ids) - 1) AS i
+            MERGE (c:Commit {id: $ids[i]})
+            ON CREATE SET
+                c.message = $messages[i],
+                c.author = $authors[i],
+                c.time = $times[i],
+                c.depth = $depths[i]
+            ON MATCH SET
+                c.message = coalesce(c.message, $messages[i]),
+                c.author = coalesce(c.author, $authors[i]),
+                c.time = coalesce(c.time, $times[i]),
+                c.depth = coalesce(c.depth, $depths[i])
+            SET c.synced = CASE WHEN $synced THEN true ELSE c.synced END
+            MERGE (c)-[:BELONGS_TO]->(r)
+        """,
+            repo_url=repo_url,
+            synced=synced,
+            ids=columns['ids'],
+            messages=columns['messages'],
+            authors=columns['authors'],
+            times=columns['times'],
+            depths=columns['depths']
+        ).consume()
+
+    @staticmethod
+    def _merge_parent_edges(tx, columns: Dict[str, List]):
+        """
+        批量创建提交之间的父子关系
+        尚未保存的父提交先创建为只有id的占位节点，待其保存时再补全属性
+        """
+        # 只传入有父提交的提交ID及其父提交ID列
+        ids, parents = [], []
+        for commit_id, parent_ids in zip(columns['ids'], columns['parents']):
+            if parent_ids:
+                ids.append(commit_id)
+                parents.append(parent_ids)
+
+        tx.run("""
+            UNWIND range(0, size($ids) - 1) AS i
+            MATCH (c:Commit {id: $ids[i]})
+            UNWIND $parents[i] AS parent_id
+            MERGE (p:Commit {id: parent_id})
+            MERGE (c)-[:PARENT]->(p)
+        """, ids=ids, parents=parents).consume()
 
     def get_commits_between(self, repo_url: str, start_commit_id: str, end_commit_id: str) -> List[Dict]:
         """
         获取两个提交之间的所有提交
+        与git的结果一致：从起始提交可达、但不是结束提交祖先的提交，以及结束提交本身；
+        深度为到起始提交的最短距离。范围内有尚未保存的提交时结果不完整，返回空列表
 
         :param repo_url: 仓库URL
         :param start_commit_id: 起始提交ID（较新的提交）
@@ -91,11 +358,19 @@ class GitDatabase:
         """
         with self._driver.session() as session:
             result = session.run("""
-                MATCH path = shortestPath((start:Commit {id: $start_id})-[:PARENT*]->(end:Commit {id: $end_id}))
-                WITH nodes(path) as commits
-                UNWIND range(0, size(commits)-1) as idx
-                WITH commits[idx] as commit, idx as depth
-                MATCH (commit)-[:BELONGS_TO]->(r:Repository {url: $repo_url})
+                MATCH (r:Repository {url: $repo_url})
+                MATCH (start:Commit {id: $start_id})-[:BELONGS_TO]->(r)
+                MATCH (end:Commit {id: $end_id})-[:BELONGS_TO]->(r)
+                WHERE EXISTS { (start)-[:PARENT*0..]->(end) }
+                MATCH path = (start)-[:PARENT*0..]->(c:Commit)
+                WHERE NOT (end)-[:PARENT*1..]->(c)
+                WITH r, c, min(length(path)) as depth
+                // 只保存为占位节点的父提交也会被遍历到，此时数据库中的范围不完整
+                WITH c, depth, EXISTS { (c)-[:BELONGS_TO]->(r) } as saved
+                WITH collect({commit: c, depth: depth, saved: saved}) as rows
+                WHERE all(row IN rows WHERE row.saved)
+                UNWIND rows as row
+                WITH row.commit as commit, row.depth as depth
                 OPTIONAL MATCH (commit)-[:PARENT]->(p:Commit)
                 WITH commit, depth, COLLECT(p.id) as parents
                 RETURN {
@@ -120,28 +395,34 @@ class GitDatabase:
         :param max_depth: 最大深度，-1表示不限制
         :return: 提交信息列表，按深度排序（从新到旧）
         """
+        if max_depth < -1:
+            return []
+
+        # 将深度上限直接写入路径模式，使查询计划器可以进行有界展开
+        hops = "0.." if max_depth == -1 else f"0..{int(max_depth)}"
+
         with self._driver.session() as session:
-            query = """
-                MATCH path = (start:Commit {id: $start_id})-[:PARENT*0..]->(c:Commit)
-                WHERE $max_depth = -1 OR length(path) <= $max_depth
-                MATCH (c)-[:BELONGS_TO]->(r:Repository {url: $repo_url})
+            query = f"""
+                MATCH (r:Repository {{url: $repo_url}})
+                MATCH path = (start:Commit {{id: $start_id}})-[:PARENT*{hops}]->(c:Commit)
+                WITH r, c, min(length(path)) as depth
+                MATCH (c)-[:BELONGS_TO]->(r)
                 OPTIONAL MATCH (c)-[:PARENT]->(p:Commit)
-                WITH c, length(path) as depth, COLLECT(p.id) as parents
-                RETURN {
+                WITH c, depth, COLLECT(p.id) as parents
+                RETURN {{
                     id: c.id,
                     message: c.message,
                     author: c.author,
                     time: c.time,
                     depth: depth,
                     parents: parents
-                } as commit_info
+                }} as commit_info
                 ORDER BY depth ASC
             """
             
             result = session.run(
                 query,
                 start_id=start_commit_id,
-                max_depth=max_depth,
                 repo_url=repo_url
             )
             
@@ -173,6 +454,63 @@ class GitDatabase:
             record = result.single()
             return record["commit_info"] if record else None
 
+    def get_existing_commit_ids(
+        self,
+        repo_url: str,
+        commit_ids: Iterable[str],
+        session: Optional[Session] = None
+    ) -> Set[str]:
+        """
+        批量查询已存在于数据库中的提交
+
+        :param repo_url: 仓库URL
+        :param commit_ids: 待查询的提交ID
+        :param session: 复用的会话，不提供时打开新会话
+        :return: 已存在的提交ID集合
+        """
+        commit_ids = list(commit_ids)
+        if not commit_ids:
+            return set()
+
+        with self._session(session) as session:
+            result = session.run("""
+                MATCH (r:Repository {url: $repo_url})
+                UNWIND $commit_ids AS commit_id
+                MATCH (c:Commit {id: commit_id})-[:BELONGS_TO]->(r)
+                RETURN c.id AS id
+            """, commit_ids=commit_ids, repo_url=repo_url)
+
+            return {record["id"] for record in result}
+
+    def get_synced_commit_ids(
+        self,
+        repo_url: str,
+        commit_ids: Iterable[str],
+        session: Optional[Session] = None
+    ) -> Set[str]:
+        """
+        批量查询已由同步历史保存的提交，这些提交的祖先也都已保存
+
+        :param repo_url: 仓库URL
+        :param commit_ids: 待查询的提交ID
+        :param session: 复用的会话，不提供时打开新会话
+        :return: 已同步的提交ID集合
+        """
+        commit_ids = list(commit_ids)
+        if not commit_ids:
+            return set()
+
+        with self._session(session) as session:
+            result = session.run("""
+                MATCH (r:Repository {url: $repo_url})
+                UNWIND $commit_ids AS commit_id
+                MATCH (c:Commit {id: commit_id})-[:BELONGS_TO]->(r)
+                WHERE c.synced
+                RETURN c.id AS id
+            """, commit_ids=commit_ids, repo_url=repo_url)
+
+            return {record["id"] for record in result}
+
     def delete_repository(self, repo_url: str) -> int:
         """
         删除仓库及其所有相关的提交信息
@@ -181,21 +519,17 @@ class GitDatabase:
         :return: 删除的节点数量
         """
         with self._driver.session() as session:
-            # 首先统计要删除的节点数量
-            count_result = session.run("""
-                MATCH (r:Repository {url: $repo_url})<-[:BELONGS_TO]-(c:Commit)
-                RETURN count(c) as commit_count
-            """, repo_url=repo_url)
-            commit_count = count_result.single()["commit_count"] if count_result.single() else 0
-
-            # 删除仓库及其所有相关的提交
-            result = session.run("""
+            # 在同一个查询中统计并删除仓库及其所有相关的提交
+            record = session.run("""
                 MATCH (r:Repository {url: $repo_url})
                 OPTIONAL MATCH (r)<-[:BELONGS_TO]-(c:Commit)
-                DETACH DELETE c, r
-            """, repo_url=repo_url)
-            
-            return commit_count
+                WITH r, collect(c) AS commits
+                FOREACH (commit IN commits | DETACH DELETE commit)
+                DETACH DELETE r
+                RETURN size(commits) AS commit_count
+            """, repo_url=repo_url).single()
+
+            return record["commit_count"] if record else 0
 
     def __enter__(self):
         return self
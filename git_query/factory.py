@@ -1,8 +1,19 @@
 from typing import Optional
+from functools import lru_cache
 import os
 import re
 from .git_operations import GitOperations
 
+# 最多缓存的 GitOperations 实例数量
+INSTANCE_CACHE_SIZE = 64
+
+# 支持 HTTP(S)、SSH 和 file 格式的 URL
+_DOMAIN_PATTERNS = (
+    re.compile(r'https?://(?:www\.)?([^/]+)'),  # HTTP(S) URL
+    re.compile(r'git@([^:]+):'),                # SSH URL
+    re.compile(r'file://([^/]*)'),              # 本地仓库的 file URL，主机名通常为空
+)
+
 class GitOperationsFactory:
     """Git操作工厂类，根据不同域名提供对应的认证信息"""
     
@@ -16,16 +27,30 @@ class GitOperationsFactory:
     @classmethod
     def create(cls, repo_url: str) -> GitOperations:
         """
-        根据仓库URL创建对应的Git操作实例
+        根据仓库URL获取对应的Git操作实例
+        同一仓库和token复用同一个实例，使其已打开的仓库和引用解析结果在请求之间共享
         
         :param repo_url: 仓库URL
         :return: GitOperations实例
         """
         domain = cls._extract_domain(repo_url)
         token = cls._get_token_for_domain(domain)
+        return cls._get_instance(repo_url, token)
+
+    @classmethod
+    @lru_cache(maxsize=INSTANCE_CACHE_SIZE)
+    def _get_instance(cls, repo_url: str, token: Optional[str]) -> GitOperations:
+        """
+        按仓库URL和token缓存Git操作实例，token变化时创建新实例
+
+        :param repo_url: 仓库URL
+        :param token: 认证token
+        :return: GitOperations实例
+        """
         return GitOperations(token)
 
     @classmethod
+    @lru_cache(maxsize=1024)
     def _extract_domain(cls, url: str) -> str:
         """
         从URL中提取域名
@@ -33,14 +58,8 @@ class GitOperationsFactory:
         :param url: 仓库URL
         :return: 域名
         """
-        # 支持 HTTP(S) 和 SSH 格式的 URL
-        patterns = [
-            r'https?://(?:www\.)?([^/]+)',  # HTTP(S) URL
-            r'git@([^:]+):',                # SSH URL
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
+        for pattern in _DOMAIN_PATTERNS:
+            match = pattern.search(url)
             if match:
                 return match.group(1)
         
@@ -1,10 +1,59 @@
 import pygit2
 from pygit2.enums import ObjectType
-from typing import List, Dict, Union, Optional
-import tempfile
+from typing import List, Dict, Union, Optional, Set, Iterator, Tuple, Sequence
+from collections import OrderedDict, deque
+import hashlib
+import base64
+import threading
 import shutil
+import subprocess
+import logging
 import os
+import re
+import time
+import weakref
 from pathlib import Path
+from itertools import chain, count
+import heapq
+
+logger = logging.getLogger(__name__)
+
+# 克隆仓库的缓存根目录，每个仓库以 URL 的 sha1 作为子目录，可通过 GIT_CACHE 环境变量指定
+CACHE_ROOT = Path(os.getenv('GIT_CACHE') or Path.home() / '.cache' / 'git_query')
+# 进程内最多保留的仓库数量，超出后淘汰最久未使用的仓库
+REPO_CACHE_SIZE = int(os.getenv('GIT_REPO_CACHE_SIZE', '32'))
+# 同一实例在该时间（秒）内复用已拉取的仓库，不再重复拉取
+FETCH_INTERVAL = float(os.getenv('GIT_FETCH_INTERVAL', '60'))
+# 拉取时同步所有分支和标签，使裸仓库中的 refs/heads 与远程保持一致
+FETCH_REFSPECS = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+# libgit2 中表示将浅克隆补全为完整历史的拉取深度
+FETCH_DEPTH_UNSHALLOW = 2147483647
+# 完整的commit id，其内容不会改变
+COMMIT_ID_PATTERN = re.compile(r'[0-9a-fA-F]{40}')
+
+_repo_cache: "OrderedDict[str, pygit2.Repository]" = OrderedDict()
+_repo_locks: Dict[str, threading.Lock] = {}
+# 浅克隆仓库的拉取深度，不在其中的仓库拥有完整历史
+_repo_depths: Dict[str, int] = {}
+_cache_lock = threading.Lock()
+# 已淘汰但可能仍在被其他请求使用的仓库: 仓库缓存键 -> (仓库对象的弱引用, 浅克隆深度)
+# 仓库对象被回收后才删除目录，正在遍历的请求不会丢失对象库；回收前再次请求时直接放回缓存
+_evicted_repos: Dict[str, Tuple[weakref.ref, Optional[int]]] = {}
+# 已淘汰且对象已被回收、等待删除目录的仓库缓存键，由弱引用回调添加
+_pending_removals: deque = deque()
+
+def _fast_rmtree(path: Path):
+    """
+    删除目录树
+    大仓库的 pack 和索引文件较多，POSIX 系统上使用 rm -rf 比 shutil.rmtree 快得多
+    """
+    if os.name == 'posix':
+        try:
+            subprocess.run(['rm', '-rf', '--', str(path)], check=False)
+            return
+        except OSError:
+            pass
+    shutil.rmtree(path, ignore_errors=True)
 
 class GitOperations:
     def __init__(self, token: Optional[str] = None):
@@ -13,19 +62,17 @@ class GitOperations:
         
         :param token: Git认证token，如果不提供则尝试从GIT_TOKEN环境变量获取
         """
-        # 创建临时目录
-        self.temp_dir = tempfile.mkdtemp(prefix='git_query_')
-        self.repo_path = Path(self.temp_dir) / 'repo'
         # 获取 Git Token
         self.git_token = token or os.getenv('GIT_TOKEN')
-
-    def __del__(self):
-        """清理临时目录"""
-        try:
-            if os.path.exists(self.temp_dir):
-                shutil.rmtree(self.temp_dir)
-        except Exception:
-            pass
+        # 引用解析结果缓存: (仓库路径, 引用名) -> 提交ID，拉取更新后失效
+        self._ref_cache: Dict[Tuple[str, str], pygit2.Oid] = {}
+        # 本实例已获取过的仓库: 仓库缓存键 -> (仓库对象的弱引用, 拉取时间)，拉取间隔内不重复拉取；
+        # 使用弱引用，不会阻止已淘汰仓库的目录被删除
+        self._repos: Dict[str, Tuple[weakref.ref, float]] = {}
+        # 工厂复用实例，同一实例会被多个请求线程同时使用，以上两个缓存的读写需持有该锁
+        self._state_lock = threading.Lock()
+        # 引用解析缓存的版本，拉取更新清空缓存时递增，避免拉取前解析的结果在清空后写入
+        self._ref_generation = 0
 
     def _create_callbacks(self) -> pygit2.RemoteCallbacks:
         """创建带有认证信息的回调"""
@@ -35,54 +82,539 @@ class GitOperations:
             return pygit2.RemoteCallbacks(credentials=credentials)
         return pygit2.RemoteCallbacks()
 
-    def _clone_repository(self, remote_url: str) -> pygit2.Repository:
-        """克隆仓库或使用现有仓库"""
+    @staticmethod
+    def _get_cache_path(remote_url: str) -> Path:
+        """获取仓库在缓存目录中的路径"""
+        return CACHE_ROOT / hashlib.sha1(remote_url.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _shallow_depth(max_depth: int) -> Optional[int]:
+        """
+        计算查询指定深度的提交所需的克隆深度
+
+        多拉取一层提交，保证返回的提交都不是浅克隆的边界，其父提交信息完整
+
+        :param max_depth: 最大深度，-1表示不限制深度
+        :return: 克隆深度，None表示需要完整历史
+        """
+        if max_depth < 0:
+            return None
+        return max_depth + 2
+
+    @staticmethod
+    def _get_shallow_ids(repo: pygit2.Repository) -> Set[str]:
+        """获取浅克隆边界上的提交ID，这些提交的父提交未被拉取"""
+        if not repo.is_shallow:
+            return set()
+        shallow_file = Path(repo.path) / 'shallow'
+        if not shallow_file.exists():
+            return set()
+        return set(shallow_file.read_text().split())
+
+    def _clone_repository(
+        self,
+        remote_url: str,
+        depth: Optional[int] = None,
+        commit_ids: Sequence[str] = ()
+    ) -> pygit2.Repository:
+        """
+        克隆仓库或使用缓存中的仓库
+        缓存命中时只拉取增量更新，未命中时克隆到缓存目录
+
+        :param remote_url: 远程仓库地址
+        :param depth: 克隆深度，None表示需要完整历史；缓存中的仓库深度不足时会加深拉取
+        :param commit_ids: 本次需要的引用，均为本地已有的完整commit id时不拉取更新
+        """
+        key = remote_url.rstrip('/')
+        with self._state_lock:
+            repo_ref, fetched_at = self._repos.get(key, (None, 0.0))
+        repo = repo_ref() if repo_ref is not None else None
+        if repo is not None and (
+            time.monotonic() - fetched_at < FETCH_INTERVAL
+            or self._contains_commits(repo, commit_ids)
+        ):
+            with _cache_lock:
+                reusable = _repo_cache.get(key) is repo and self._covers_depth(key, depth)
+            if reusable:
+                return repo
+
+        repo = self._acquire_repository(remote_url, depth, commit_ids)
+        with self._state_lock:
+            self._repos[key] = (weakref.ref(repo), time.monotonic())
+
+        self._remove_evicted_repositories()
+        return repo
+
+    def _acquire_repository(
+        self,
+        remote_url: str,
+        depth: Optional[int],
+        commit_ids: Sequence[str] = ()
+    ) -> pygit2.Repository:
+        """
+        从内存缓存、磁盘缓存或远程获取仓库
+
+        :param remote_url: 远程仓库地址
+        :param depth: 克隆深度，None表示需要完整历史
+        :param commit_ids: 本次需要的引用，均为本地已有的完整commit id时不拉取更新
+        :return: 仓库对象
+        """
+        key = remote_url.rstrip('/')
+        with _cache_lock:
+            repo_lock = _repo_locks.setdefault(key, threading.Lock())
+
+        # 同一仓库的克隆和拉取串行执行
+        with repo_lock:
+            with _cache_lock:
+                repo = _repo_cache.get(key)
+                if repo is not None:
+                    _repo_cache.move_to_end(key)
+                    if self._covers_depth(key, depth) and self._contains_commits(repo, commit_ids):
+                        return repo
+                else:
+                    # 已淘汰但仍在使用的仓库目录还未删除，直接放回缓存
+                    repo = self._revive_repository(key)
+
+            repo_path = self._get_cache_path(key)
+            if repo is None:
+                # 进程重启后复用磁盘上已有的克隆，只拉取增量
+                repo = self._open_cached_repository(repo_path)
+                if repo is not None:
+                    with _cache_lock:
+                        _repo_cache[key] = repo
+                        _repo_depths.pop(key, None)
+                        self._evict_repositories()
+
+            if repo is not None:
+                return self._update_repository(key, repo, depth)
+
+            # 清理上次未完成、已被淘汰或无法复用的目录
+            if repo_path.exists():
+                _fast_rmtree(repo_path)
+            repo_path.parent.mkdir(parents=True, exist_ok=True)
+
+            if self._clone_without_blobs(remote_url, repo_path, depth):
+                repo = pygit2.Repository(str(repo_path))
+            else:
+                try:
+                    # 使用带认证的回调
+                    repo = pygit2.clone_repository(
+                        remote_url,
+                        str(repo_path),
+                        bare=True,
+                        callbacks=self._create_callbacks(),
+                        depth=depth or 0
+                    )
+                except pygit2.GitError:
+                    if not depth:
+                        raise
+                    # 部分传输方式（如本地仓库）不支持浅克隆，退回完整克隆
+                    _fast_rmtree(repo_path)
+                    repo = pygit2.clone_repository(
+                        remote_url,
+                        str(repo_path),
+                        bare=True,
+                        callbacks=self._create_callbacks()
+                    )
+
+            # 以实际克隆结果为准，不支持浅克隆时得到的是完整历史
+            if not repo.is_shallow:
+                depth = None
+            if not depth:
+                self._write_commit_graph(repo)
+
+            with _cache_lock:
+                _repo_cache[key] = repo
+                if depth:
+                    _repo_depths[key] = depth
+                else:
+                    _repo_depths.pop(key, None)
+                self._evict_repositories()
+
+        return repo
+
+    def _clone_without_blobs(
+        self,
+        remote_url: str,
+        repo_path: Path,
+        depth: Optional[int]
+    ) -> bool:
+        """
+        使用 git 命令行进行不下载文件内容的部分克隆（--filter=blob:none）
+        查询只需要提交对象，跳过 blob 可以大幅减少下载量和磁盘占用；libgit2 不支持部分克隆
+
+        :param remote_url: 远程仓库地址
+        :param repo_path: 克隆目标路径
+        :param depth: 克隆深度，None表示需要完整历史
+        :return: 是否克隆成功，git 不可用或克隆失败时返回False
+        """
+        args = ['clone', '--bare', '--quiet', '--filter=blob:none']
+        if depth:
+            # --depth 默认只克隆默认分支，需要同时拉取其他分支和标签
+            args += ['--depth', str(depth), '--no-single-branch']
+        args += ['--', remote_url, str(repo_path)]
+
+        if self._run_git(args):
+            return True
+        _fast_rmtree(repo_path)
+        return False
+
+    def _run_git(self, args: List[str]) -> bool:
+        """
+        执行 git 命令
+
+        :param args: git 命令参数
+        :return: 是否执行成功，git 不可用或执行失败时返回False
+        """
+        env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+        if self.git_token:
+            # 通过环境变量传入认证头，避免 token 出现在进程参数或仓库配置中
+            credentials = base64.b64encode(f"git:{self.git_token}".encode()).decode()
+            env.update({
+                'GIT_CONFIG_COUNT': '1',
+                'GIT_CONFIG_KEY_0': 'http.extraHeader',
+                'GIT_CONFIG_VALUE_0': f"Authorization: Basic {credentials}",
+            })
+
         try:
-            return pygit2.Repository(str(self.repo_path))
-        except:
-            # 确保目录存在
-            self.repo_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # 使用带认证的回调
-            callbacks = self._create_callbacks()
-            return pygit2.clone_repository(
-                remote_url,
-                str(self.repo_path),
-                bare=True,
-                callbacks=callbacks
+            subprocess.run(['git', *args], check=True, capture_output=True, env=env)
+            return True
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning("执行 git 命令失败，使用 libgit2 代替: %s", e)
+            return False
+
+    def _fetch(self, repo: pygit2.Repository, fetch_depth: int) -> int:
+        """
+        从远程拉取所有分支和标签
+
+        完整拉取和补全历史优先使用 git 命令行，保持部分克隆不下载文件内容；
+        git 命令行在分支未更新时不会加深已有的浅克隆边界，因此加深拉取使用 libgit2，
+        传输方式不支持时退回补全完整历史
+
+        :param repo: Git仓库对象
+        :param fetch_depth: 拉取深度，0表示完整历史，FETCH_DEPTH_UNSHALLOW表示补全浅克隆
+        :return: 实际使用的拉取深度
+        """
+        fetch_args = ['--git-dir', repo.path, 'fetch', '--quiet']
+        if fetch_depth not in (0, FETCH_DEPTH_UNSHALLOW):
+            try:
+                repo.remotes['origin'].fetch(
+                    FETCH_REFSPECS,
+                    callbacks=self._create_callbacks(),
+                    depth=fetch_depth
+                )
+                return fetch_depth
+            except pygit2.GitError:
+                fetch_depth = FETCH_DEPTH_UNSHALLOW
+
+        if not repo.is_shallow:
+            fetch_depth = 0
+        depth_args = ['--unshallow'] if fetch_depth == FETCH_DEPTH_UNSHALLOW else []
+        if not self._run_git([*fetch_args, *depth_args, 'origin', *FETCH_REFSPECS]):
+            repo.remotes['origin'].fetch(
+                FETCH_REFSPECS,
+                callbacks=self._create_callbacks(),
+                depth=fetch_depth
             )
+        return fetch_depth
 
-    def _get_commit_object(self, repo: pygit2.Repository, ref_name: str) -> pygit2.Commit:
-        """获取指定引用的commit对象"""
+    @staticmethod
+    def _get_ref_targets(repo: pygit2.Repository) -> Dict[str, str]:
+        """获取仓库中所有引用指向的对象，用于判断拉取是否带来了更新"""
+        return {ref.name: str(ref.target) for ref in repo.references.iterator()}
+
+    @staticmethod
+    def _open_cached_repository(repo_path: Path) -> Optional[pygit2.Repository]:
+        """
+        打开磁盘缓存中已有的完整克隆
+
+        浅克隆的深度无法从磁盘恢复，按指定深度拉取可能反而截短历史，因此不复用
+
+        :param repo_path: 仓库缓存路径
+        :return: 可复用的仓库对象，不存在或无法复用时返回None
+        """
+        if not repo_path.exists():
+            return None
         try:
-            if ref_name.startswith('refs/'):
-                ref_path = ref_name
+            repo = pygit2.Repository(str(repo_path))
+        except pygit2.GitError:
+            return None
+        if repo.is_shallow or 'origin' not in repo.remotes.names():
+            return None
+        return repo
+
+    def _update_repository(
+        self,
+        key: str,
+        repo: pygit2.Repository,
+        depth: Optional[int]
+    ) -> pygit2.Repository:
+        """
+        拉取缓存仓库的增量更新，缓存深度不足时加深拉取
+
+        :param key: 仓库缓存键
+        :param repo: 缓存中的仓库对象
+        :param depth: 需要的克隆深度，None表示需要完整历史
+        :return: 更新后的仓库对象
+        """
+        cached_depth = _repo_depths.get(key)
+        if cached_depth is None:
+            fetch_depth = 0
+        elif depth is None:
+            fetch_depth = FETCH_DEPTH_UNSHALLOW
+        else:
+            fetch_depth = max(cached_depth, depth)
+
+        refs_before = self._get_ref_targets(repo)
+        fetch_depth = self._fetch(repo, fetch_depth)
+        with self._state_lock:
+            self._ref_cache.clear()
+            self._ref_generation += 1
+
+        if cached_depth is not None:
+            # libgit2 在打开仓库时加载浅克隆边界，加深拉取后需要重新打开才能看到新的父提交
+            repo = pygit2.Repository(repo.path)
+            # 远程历史不足拉取深度时得到的是完整历史
+            if not repo.is_shallow:
+                fetch_depth = 0
+
+        # 补全了历史或拉取到新提交的完整历史仓库需要更新 commit-graph
+        if fetch_depth in (0, FETCH_DEPTH_UNSHALLOW) and (
+            cached_depth is not None or self._get_ref_targets(repo) != refs_before
+        ):
+            self._write_commit_graph(repo)
+
+        with _cache_lock:
+            if key in _repo_cache:
+                _repo_cache[key] = repo
+            if fetch_depth in (0, FETCH_DEPTH_UNSHALLOW):
+                _repo_depths.pop(key, None)
             else:
-                # 尝试不同的引用路径
-                possible_refs = [
-                    f'refs/tags/{ref_name}',
-                    f'refs/heads/{ref_name}',
-                    ref_name  # 可能是commit id
-                ]
-                ref_path = next(
-                    ref for ref in possible_refs
-                    if ref in repo.references or repo.get(ref_name)
-                )
+                _repo_depths[key] = fetch_depth
+        return repo
 
-            if ref_path in repo.references:
-                ref = repo.lookup_reference(ref_path)
-                obj = ref.peel()
-                if obj.type == ObjectType.TAG:
-                    return obj.peel()
+    @staticmethod
+    def _covers_depth(key: str, depth: Optional[int]) -> bool:
+        """判断缓存仓库的历史深度是否满足需要，需在持有 _cache_lock 时调用"""
+        cached_depth = _repo_depths.get(key)
+        return cached_depth is None or (depth is not None and depth <= cached_depth)
+
+    @staticmethod
+    def _contains_commits(repo: pygit2.Repository, commit_ids: Sequence[str]) -> bool:
+        """
+        判断引用是否都是仓库中已有的完整commit id
+        commit id 指向的内容不会改变，已存在时无需拉取；分支和标签可能移动，总是返回False
+        """
+        if not commit_ids:
+            return False
+        for commit_id in commit_ids:
+            if not COMMIT_ID_PATTERN.fullmatch(commit_id):
+                return False
+            obj = repo.get(commit_id)
+            if obj is None or obj.type != ObjectType.COMMIT:
+                return False
+        return True
+
+    @staticmethod
+    def _evict_repositories():
+        """
+        淘汰超出缓存容量的最久未使用仓库，需在持有 _cache_lock 时调用
+        仓库对象被回收后其缓存键加入 _pending_removals，由 _remove_evicted_repositories 删除目录
+        """
+        while len(_repo_cache) > REPO_CACHE_SIZE:
+            evicted_key, evicted_repo = _repo_cache.popitem(last=False)
+            # 弱引用回调可能在任意线程中执行，只记录缓存键，不获取锁
+            _evicted_repos[evicted_key] = (
+                weakref.ref(evicted_repo, lambda _, key=evicted_key: _pending_removals.append(key)),
+                _repo_depths.pop(evicted_key, None)
+            )
+
+    @classmethod
+    def _revive_repository(cls, key: str) -> Optional[pygit2.Repository]:
+        """
+        将已淘汰但仍未被回收的仓库放回缓存，需在持有 _cache_lock 时调用
+
+        :param key: 仓库缓存键
+        :return: 放回缓存的仓库对象，仓库未被淘汰或已被回收时返回None
+        """
+        repo_ref, depth = _evicted_repos.pop(key, (None, None))
+        repo = repo_ref() if repo_ref is not None else None
+        if repo is None:
+            return None
+        _repo_cache[key] = repo
+        if depth:
+            _repo_depths[key] = depth
+        cls._evict_repositories()
+        return repo
+
+    def _remove_evicted_repositories(self):
+        """
+        删除已淘汰且对象已被回收的仓库目录，调用时不能持有任何仓库锁
+
+        持有该仓库的锁删除，与同一仓库的克隆串行执行；删除前确认仓库没有重新放回缓存
+        """
+        while _pending_removals:
+            try:
+                key = _pending_removals.popleft()
+            except IndexError:
+                break
+            with _cache_lock:
+                repo_lock = _repo_locks.setdefault(key, threading.Lock())
+            with repo_lock:
+                with _cache_lock:
+                    repo_ref, _ = _evicted_repos.get(key, (None, None))
+                    # 仓库已重新放回缓存，或再次淘汰后仍在使用时保留目录
+                    if key in _repo_cache or repo_ref is None or repo_ref() is not None:
+                        continue
+                    del _evicted_repos[key]
+                _fast_rmtree(self._get_cache_path(key))
+
+    @staticmethod
+    def _write_commit_graph(repo: pygit2.Repository):
+        """
+        为仓库生成 commit-graph 文件
+        libgit2 遍历提交时可以直接从该文件读取父提交和提交时间，无需解压和解析提交对象
+
+        浅克隆的父提交信息不完整，不生成 commit-graph
+        """
+        repo.config['core.commitGraph'] = True
+        try:
+            subprocess.run(
+                ['git', '--git-dir', repo.path, 'commit-graph', 'write', '--reachable'],
+                check=True,
+                capture_output=True
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            # commit-graph 只用于加速，生成失败不影响查询
+            logger.warning("生成 commit-graph 失败: %s", e)
+
+    @staticmethod
+    def _get_root_commit_id(repo: pygit2.Repository) -> Optional[str]:
+        """
+        使用 git rev-list 获取 HEAD 可达的最初提交
+
+        :param repo: Git仓库对象
+        :return: 最初提交的ID，git 不可用或执行失败时返回None
+        """
+        try:
+            result = subprocess.run(
+                ['git', '--git-dir', repo.path, 'rev-list', '--max-parents=0', 'HEAD'],
+                check=True,
+                capture_output=True,
+                text=True
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning("执行 git rev-list 失败，遍历提交查找: %s", e)
+            return None
+
+        # 存在多个根提交时与按时间遍历一致，取最新的一个
+        lines = result.stdout.split()
+        return lines[0] if lines else None
+
+    def _open_ref(
+        self,
+        remote_url: str,
+        ref_name: str,
+        depth: Optional[int] = None
+    ) -> Tuple[pygit2.Repository, pygit2.Commit]:
+        """
+        获取仓库并解析引用
+        浅克隆中找不到引用（如较早的commit id）时，补全历史后重试
+
+        :param remote_url: 远程仓库地址
+        :param ref_name: 引用名称
+        :param depth: 克隆深度，None表示需要完整历史
+        :return: 仓库对象和引用对应的commit对象
+        """
+        try:
+            repo, (commit,) = self._open_refs(remote_url, (ref_name,), depth=depth)
+            return repo, commit
+        except ValueError:
+            with _cache_lock:
+                shallow = remote_url.rstrip('/') in _repo_depths
+            if not shallow:
+                raise
+        repo, (commit,) = self._open_refs(remote_url, (ref_name,))
+        return repo, commit
+
+    def _open_refs(
+        self,
+        remote_url: str,
+        ref_names: Sequence[str],
+        depth: Optional[int] = None
+    ) -> Tuple[pygit2.Repository, List[pygit2.Commit]]:
+        """
+        获取仓库并解析多个引用
+        拉取间隔内直接在本地仓库中解析；找不到引用（如之后新建的标签或分支）时立即拉取后重试
+
+        :param remote_url: 远程仓库地址
+        :param ref_names: 引用名称列表
+        :param depth: 克隆深度，None表示需要完整历史
+        :return: 仓库对象和各引用对应的commit对象
+        """
+        key = remote_url.rstrip('/')
+        with self._state_lock:
+            memo = self._repos.get(key)
+        repo = self._clone_repository(remote_url, depth=depth, commit_ids=ref_names)
+        try:
+            return repo, [self._get_commit_object(repo, ref_name) for ref_name in ref_names]
+        except ValueError:
+            # 本次调用期间已经拉取过（包括其他线程的拉取）时引用确实不存在
+            with self._state_lock:
+                if self._repos.get(key) is not memo:
+                    raise
+                # 使记录的拉取时间失效，强制拉取一次
+                self._repos.pop(key, None)
+        repo = self._clone_repository(remote_url, depth=depth, commit_ids=ref_names)
+        return repo, [self._get_commit_object(repo, ref_name) for ref_name in ref_names]
+
+    def _get_commit_object(self, repo: pygit2.Repository, ref_name: str) -> pygit2.Commit:
+        """获取指定引用的commit对象，解析结果会被缓存"""
+        key = (repo.path, ref_name)
+        with self._state_lock:
+            commit_id = self._ref_cache.get(key)
+            generation = self._ref_generation
+        if commit_id is not None:
+            return repo[commit_id]
+
+        commit = self._resolve_commit_object(repo, ref_name)
+        with self._state_lock:
+            # 解析期间有拉取更新时结果可能已过期，不写入缓存
+            if self._ref_generation == generation:
+                self._ref_cache[key] = commit.id
+        return commit
+
+    @staticmethod
+    def _resolve_commit_object(repo: pygit2.Repository, ref_name: str) -> pygit2.Commit:
+        """解析指定引用对应的commit对象"""
+        # 与 git 一致，完整的commit id优先作为对象ID查找，无需查找引用
+        if COMMIT_ID_PATTERN.fullmatch(ref_name):
+            obj = repo.get(ref_name)
+            if obj is not None and obj.type == ObjectType.COMMIT:
                 return obj
-            else:
-                # 尝试作为commit id处理
-                obj = repo.get(ref_name)
-                if obj and obj.type == ObjectType.COMMIT:
-                    return obj
-                raise ValueError(f"Error: Reference not found: {ref_name}")
-        except StopIteration:
+
+        if ref_name.startswith('refs/'):
+            possible_refs = (ref_name,)
+        else:
+            # 依次尝试标签和分支，每个候选只查找一次引用
+            possible_refs = (f'refs/tags/{ref_name}', f'refs/heads/{ref_name}')
+
+        references = repo.references
+        for ref_path in possible_refs:
+            ref = references.get(ref_path)
+            if ref is not None:
+                # 附注标签会一直剥离到其指向的提交
+                return ref.peel(pygit2.Commit)
+
+        # 都不是引用时才作为commit id查找对象
+        try:
+            obj = repo.get(ref_name)
+        except ValueError:
+            # 不是合法的十六进制ID
             raise ValueError(f"Error: Invalid reference: {ref_name}")
+        if obj is not None and obj.type == ObjectType.COMMIT:
+            return obj
+        raise ValueError(f"Error: Reference not found: {ref_name}")
 
     def get_commits_between(
         self,
@@ -98,48 +630,97 @@ class GitOperations:
         :param end_ref: 结束引用（分支名、tag名或commit id）
         :return: 包含提交信息的列表
         """
-        repo = self._clone_repository(remote_url)
-        
         # 获取起始和结束的commit对象
-        start_commit = self._get_commit_object(repo, start_ref)
-        end_commit = self._get_commit_object(repo, end_ref)
+        repo, (start_commit, end_commit) = self._open_refs(remote_url, (start_ref, end_ref))
 
-        # 使用广度优先搜索获取所有提交
-        commits = []
-        visited = set()
-        queue = [(start_commit, 0)]  # (commit, depth)
-        found_end = False
+        return self._get_commits_between_ids(repo, start_commit, end_commit)
 
-        while queue and not found_end:
-            commit, depth = queue.pop(0)
-            if commit.id in visited:
-                continue
+    def _get_commits_between_ids(
+        self,
+        repo: pygit2.Repository,
+        start_commit: pygit2.Commit,
+        end_commit: pygit2.Commit
+    ) -> List[Dict[str, Union[str, int, List[str]]]]:
+        """
+        获取两个已解析的提交之间的所有提交信息
 
-            visited.add(commit.id)
-            
-            # 添加提交信息
-            commits.append({
-                "id": str(commit.id),
+        :param repo: Git仓库对象
+        :param start_commit: 起始commit对象
+        :param end_commit: 结束commit对象
+        :return: 包含提交信息的列表
+        """
+        # 使用 libgit2 的 revwalk 遍历从起始提交可达、但从目标提交不可达的提交
+        walker = repo.walk(start_commit.id, pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME)
+        walker.hide(end_commit.id)
+        levels, depths = self._walk_commit_levels(walker, start_commit.id)
+
+        # 目标提交被 hide，需要单独加入结果
+        end_id = str(end_commit.id)
+        if end_id not in depths:
+            raise ValueError("在遍历过程中未找到目标提交")
+
+        end_depth = depths[end_id]
+        if end_depth == len(levels):
+            levels.append([])
+        levels[end_depth].append({
+            "id": end_id,
+            "message": end_commit.message,
+            "author": end_commit.author.name,
+            "time": end_commit.commit_time,
+            "parents": [str(parent_id) for parent_id in end_commit.parent_ids],
+            "depth": end_depth
+        })
+
+        # 按深度从新到旧拼接，深度相同时保持拓扑顺序
+        return list(chain.from_iterable(levels))
+
+    @staticmethod
+    def _walk_commit_levels(
+        walker: pygit2.Walker,
+        start_id: pygit2.Oid
+    ) -> Tuple[List[List[Dict[str, Union[str, int, List[str]]]]], Dict[str, int]]:
+        """
+        遍历按拓扑序排序的 revwalk，计算每个提交到起始提交的最短距离
+
+        拓扑序保证子提交总是先于父提交出现，
+        因此遍历到某个提交时，它到起始提交的最短距离已经确定
+
+        :param walker: 以起始提交为起点、按拓扑序排序的 revwalk
+        :param start_id: 起始提交ID
+        :return: 按深度分组的提交信息，以及已发现提交（含未遍历的父提交）的深度
+        """
+        # 深度表以提交ID字符串为键，与结果中的 id、parents 共用同一批字符串对象，
+        # 每个提交ID只转换一次，且字符串缓存了哈希值，查表比 Oid 更快
+        depths = {str(start_id): 0}
+        get_depth = depths.get
+        # 同一作者的提交共用一个作者名字符串，作者通常远少于提交
+        intern_author = {}.setdefault
+        # 按深度分组存放结果，遍历结束后直接按层拼接，无需再排序
+        levels: List[List[Dict[str, Union[str, int, List[str]]]]] = []
+        for commit in walker:
+            commit_id = str(commit.id)
+            depth = depths[commit_id]
+            parent_depth = depth + 1
+            # parent_ids 只读取父提交ID，不需要解析父提交对象
+            parent_ids = [str(parent_id) for parent_id in commit.parent_ids]
+
+            if depth == len(levels):
+                levels.append([])
+            author = commit.author.name
+            levels[depth].append({
+                "id": commit_id,
                 "message": commit.message,
-                "author": commit.author.name,
+                "author": intern_author(author, author),
                 "time": commit.commit_time,
-                "parents": [str(parent.id) for parent in commit.parents],
+                "parents": parent_ids,
                 "depth": depth
             })
 
-            # 检查是否到达目标提交
-            if commit.id == end_commit.id:
-                found_end = True
-                break
-
-            # 将父提交添加到队列
-            for parent in commit.parents:
-                queue.append((parent, depth + 1))
+            for parent_id in parent_ids:
+                if get_depth(parent_id, parent_depth + 1) > parent_depth:
+                    depths[parent_id] = parent_depth
 
-        if not found_end:
-            raise ValueError("在遍历过程中未找到目标提交")
-
-        return commits 
+        return levels, depths
 
     def get_commits_by_depth(
         self,
@@ -155,41 +736,82 @@ class GitOperations:
         :param max_depth: 最大深度，-1表示不限制深度
         :return: 包含提交信息的列表
         """
-        repo = self._clone_repository(remote_url)
-        
-        # 获取起始commit对象
-        start_commit = self._get_commit_object(repo, start_ref)
+        # 只需要有限深度时使用浅克隆，减少拉取的数据量
+        repo, start_commit = self._open_ref(
+            remote_url,
+            start_ref,
+            depth=self._shallow_depth(max_depth)
+        )
+
+        commits = self._collect_commits_by_depth(repo, start_commit, max_depth)
+        if commits is None:
+            # 起始提交不是分支或标签的顶端，浅克隆的历史不够，补全后重新遍历
+            repo, start_commit = self._open_ref(remote_url, start_ref)
+            commits = self._collect_commits_by_depth(repo, start_commit, max_depth)
+        return commits
+
+    def _collect_commits_by_depth(
+        self,
+        repo: pygit2.Repository,
+        start_commit: pygit2.Commit,
+        max_depth: int
+    ) -> Optional[List[Dict[str, Union[str, int, List[str]]]]]:
+        """
+        从起始提交开始广度优先遍历指定深度的提交
+
+        :param repo: Git仓库对象
+        :param start_commit: 起始commit对象
+        :param max_depth: 最大深度，-1表示不限制深度
+        :return: 包含提交信息的列表，遍历到浅克隆边界导致结果不完整时返回None
+        """
+        shallow_ids = self._get_shallow_ids(repo)
+
+        if max_depth == -1 and not shallow_ids:
+            # 不限制深度时直接使用 libgit2 的 revwalk 遍历全部祖先
+            walker = repo.walk(start_commit.id, pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME)
+            levels, _ = self._walk_commit_levels(walker, start_commit.id)
+            return list(chain.from_iterable(levels))
 
         # 使用广度优先搜索获取所有提交
         commits = []
         visited = set()
-        queue = [(start_commit, 0)]  # (commit, depth)
+        # 队列中只保存提交ID字符串，出队处理时才读取提交对象；
+        # 父提交ID在生成结果时已转换为字符串，入队后直接复用，不再重复转换
+        queue = deque([(str(start_commit.id), 0)])  # (commit id, depth)
+        # 同一作者的提交共用一个作者名字符串
+        intern_author = {}.setdefault
 
         while queue:
-            commit, depth = queue.pop(0)
+            commit_id, depth = queue.popleft()
             
             # 如果设置了最大深度且当前深度超过最大深度，跳过
             if max_depth != -1 and depth > max_depth:
                 continue
                 
-            if commit.id in visited:
+            if commit_id in visited:
                 continue
 
-            visited.add(commit.id)
-            
+            visited.add(commit_id)
+            if commit_id in shallow_ids:
+                return None
+
+            commit = repo[commit_id]
+            parent_ids = [str(parent_id) for parent_id in commit.parent_ids]
+
             # 添加提交信息
+            author = commit.author.name
             commits.append({
-                "id": str(commit.id),
+                "id": commit_id,
                 "message": commit.message,
-                "author": commit.author.name,
+                "author": intern_author(author, author),
                 "time": commit.commit_time,
-                "parents": [str(parent.id) for parent in commit.parents],
+                "parents": parent_ids,
                 "depth": depth
             })
 
             # 将父提交添加到队列
-            for parent in commit.parents:
-                queue.append((parent, depth + 1))
+            for parent_id in parent_ids:
+                queue.append((parent_id, depth + 1))
 
         return commits 
 
@@ -205,12 +827,23 @@ class GitOperations:
         
         try:
             # 使用 rev-list 命令获取最早的提交
-            # 这比遍历所有提交要快得多
-            first_commit_id = repo.revparse_single('HEAD').hex
-            for commit in repo.walk(first_commit_id, pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME):
-                # GIT_SORT_TOPOLOGICAL 确保按照拓扑顺序遍历
-                # GIT_SORT_TIME 按时间戳排序
-                if len(commit.parents) == 0:
+            # 存在 commit-graph 时无需解析提交对象，这比遍历所有提交要快得多
+            root_id = self._get_root_commit_id(repo)
+            if root_id is not None:
+                commit = repo[root_id]
+                return {
+                    "id": str(commit.id),
+                    "message": commit.message,
+                    "author": commit.author.name,
+                    "time": commit.commit_time,
+                    "parents": [],
+                    "depth": 0
+                }
+
+            # git 不可用时遍历提交查找，只需找到没有父提交的节点，无需拓扑排序
+            head_id = repo.revparse_single('HEAD').id
+            for commit in repo.walk(head_id, pygit2.GIT_SORT_NONE):
+                if not commit.parent_ids:
                     # 找到没有父提交的提交，即为最初提交
                     return {
                         "id": str(commit.id),
@@ -240,33 +873,84 @@ class GitOperations:
         :param batch_size: 批次大小
         :return: 提交信息列表
         """
+        return next(self.iter_commit_batches(repo, start_commit_id, batch_size), [])
+
+    def iter_commit_batches(
+        self,
+        repo: pygit2.Repository,
+        start_commit_id: str,
+        batch_size: int = 100,
+        known_ids: Optional[Set[str]] = None
+    ) -> Iterator[List[Dict[str, Union[str, int, List[str]]]]]:
+        """
+        分批遍历指定提交及其所有上游提交
+
+        已知提交（如已同步到数据库的提交）及其祖先不会被返回，
+        调用方可以在两个批次之间向 known_ids 中添加新的已知提交
+
+        提交返回后不再修改，深度为返回时经由已遍历提交到起始提交的最短距离；
+        提交时间早于其子提交时即为真实的最短距离，存在时钟偏差或时间相同时可能偏大
+
+        :param repo: Git仓库对象
+        :param start_commit_id: 起始提交ID
+        :param batch_size: 批次大小
+        :param known_ids: 已知提交ID集合，遍历到这些提交时不再向上追溯
+        :return: 提交信息列表的迭代器，每次返回一批
+        """
+        if known_ids is None:
+            known_ids = set()
+
         try:
-            commits = []
+            start_commit = repo.get(start_commit_id)
+            # 按提交时间从新到旧遍历（与 git log 相同），时间相同时先发现的先出队，
+            # 使遍历尽早到达已同步的较早提交
+            order = count(1)
+            # 堆、深度表和已访问集合均以提交ID字符串为键，每个提交ID只转换一次
+            start_id = str(start_commit.id)
+            heap = [(-start_commit.commit_time, 0, start_id, start_commit)]
+            depths = {start_id: 0}
             visited = set()
-            queue = [(repo.get(start_commit_id), 0)]  # (commit, depth)
-            
-            while queue and len(commits) < batch_size:
-                commit, depth = queue.pop(0)
-                if commit.id in visited:
-                    continue
-                    
-                visited.add(commit.id)
-                commits.append({
-                    "id": str(commit.id),
-                    "message": commit.message,
-                    "author": commit.author.name,
-                    "time": commit.commit_time,
-                    "parents": [str(parent.id) for parent in commit.parents],
-                    "depth": depth
-                })
-                
-                # 将父提交添加到队列
-                for parent in commit.parents:
-                    queue.append((parent, depth + 1))
-                    
-            return commits
-            
+            # 同一作者的提交共用一个作者名字符串，跨批次保持
+            intern_author = {}.setdefault
+
+            while heap:
+                commits = []
+                while heap and len(commits) < batch_size:
+                    _, _, commit_id, commit = heapq.heappop(heap)
+                    if commit_id in visited:
+                        continue
+
+                    visited.add(commit_id)
+                    if commit_id in known_ids:
+                        continue
+
+                    depth = depths[commit_id]
+                    parent_ids = [str(parent_id) for parent_id in commit.parent_ids]
+                    author = commit.author.name
+                    commits.append({
+                        "id": commit_id,
+                        "message": commit.message,
+                        "author": intern_author(author, author),
+                        "time": commit.commit_time,
+                        "parents": parent_ids,
+                        "depth": depth
+                    })
+
+                    # 将父提交加入优先队列；已发现但尚未出队的父提交只更新最短深度，不再重复读取，
+                    # 已返回的提交不再更新
+                    for parent_id in parent_ids:
+                        parent_depth = depths.get(parent_id)
+                        if parent_depth is None:
+                            depths[parent_id] = depth + 1
+                            parent = repo[parent_id]
+                            heapq.heappush(heap, (-parent.commit_time, next(order), parent_id, parent))
+                        elif parent_depth > depth + 1 and parent_id not in visited:
+                            depths[parent_id] = depth + 1
+
+                if commits:
+                    yield commits
+
         except KeyError as e:
             raise ValueError(f"无效的提交ID: {start_commit_id}")
         except Exception as e:
-            raise ValueError(f"获取提交批次失败: {str(e)}")
\ No newline at end of file
+            raise ValueError(f"获取提交批次失败: {str(e)}")
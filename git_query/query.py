@@ -1,16 +1,98 @@
-from typing import List, Dict, Union, Optional
-from .db import GitDatabase
+from typing import List, Dict, Union, Optional, Tuple, Iterator
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from neo4j import Driver, Session
+from neo4j.exceptions import Neo4jError, DriverError
+from .db import GitDatabase, SAVE_BATCH_SIZE
 from .factory import GitOperationsFactory
+from . import git_operations
+from .git_operations import COMMIT_ID_PATTERN
+from pathlib import Path
 import os
-import pygit2
+import tempfile
+import threading
+from pygit2.enums import ObjectType
+
+# 数据库不可用或查询失败时的异常，发生时退回直接使用git的结果；
+# 引用无效等其他异常直接抛出，不重复执行git操作
+DATABASE_ERRORS = (Neo4jError, DriverError)
+
+# 同步历史时最多排队等待写入数据库的批次数量，超出后遍历等待写入完成
+SYNC_PENDING_WRITES = 4
+
+# 单个提交查询的进程内缓存容量，设为0时关闭缓存；提交内容不可变，只在删除仓库时失效
+COMMIT_CACHE_SIZE = int(os.getenv('COMMIT_CACHE_SIZE', '10000'))
+_commit_cache: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+_commit_cache_lock = threading.Lock()
+
+# 正在从git获取或同步的提交范围，相同范围的并发请求等待第一个请求写入数据库后直接查询结果
+_inflight_ranges: Dict[Tuple[str, ...], List] = {}
+_inflight_ranges_lock = threading.Lock()
+
+@contextmanager
+def _single_flight(key: Tuple[str, ...]) -> Iterator[bool]:
+    """
+    串行执行相同提交范围的git遍历
+
+    :param key: 仓库URL及提交范围，如起始和结束commit id
+    :return: 是否等待过其他请求，等待过时结果可能已经写入数据库
+    """
+    with _inflight_ranges_lock:
+        # 记录锁和使用者数量，最后一个使用者退出时删除，避免锁随查询范围无限增长
+        entry = _inflight_ranges.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    lock = entry[0]
+    waited = not lock.acquire(blocking=False)
+    if waited:
+        lock.acquire()
+    try:
+        yield waited
+    finally:
+        lock.release()
+        with _inflight_ranges_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _inflight_ranges[key]
+
+def _get_commits_by_depth_worker(args) -> List[Dict[str, Union[str, int, List[str]]]]:
+    """
+    在子进程中获取单个仓库指定深度的提交，每个进程使用独立的 libgit2 句柄
+
+    子进程使用单独的克隆缓存目录：服务进程在内存中记录了磁盘缓存的浅克隆深度，
+    其他进程对同一目录的克隆、拉取或删除会使这些记录失效，进程之间也没有锁
+    """
+    repo_url, start_ref, max_depth, cache_root = args
+    git_operations.CACHE_ROOT = Path(cache_root)
+    git_ops = GitOperationsFactory.create(repo_url)
+    return git_ops.get_commits_by_depth(repo_url, start_ref, max_depth)
 
 class GitQueryService:
-    def __init__(self):
-        self.db = GitDatabase(
-            uri=os.getenv('NEO4J_URI'),
-            user=os.getenv('NEO4J_USER'),
-            password=os.getenv('NEO4J_PASSWORD')
-        )
+    def __init__(self, driver: Optional[Driver] = None):
+        """
+        初始化查询服务
+
+        :param driver: 共享的Neo4j驱动，不提供时使用根据环境变量创建的进程级共享驱动
+        """
+        self._driver = driver
+        self._db: Optional[GitDatabase] = None
+
+    @property
+    def db(self) -> GitDatabase:
+        """数据库访问对象，首次使用时创建，不访问数据库的操作无需建立连接"""
+        if self._db is None:
+            driver = self._driver
+            if driver is None:
+                # 复用进程级驱动的连接池，避免每次创建服务都重新建立连接
+                driver = GitDatabase.get_shared_driver(
+                    uri=os.getenv('NEO4J_URI'),
+                    user=os.getenv('NEO4J_USER'),
+                    password=os.getenv('NEO4J_PASSWORD'),
+                    max_connection_pool_size=int(os.getenv('NEO4J_POOL_SIZE', '64'))
+                )
+            self._db = GitDatabase(driver=driver)
+        return self._db
 
     def get_commits_between(
         self,
@@ -22,43 +104,61 @@ class GitQueryService:
         获取两个引用之间的所有提交
         优先从数据库查询，如果数据不存在则从git仓库获取并同步到数据库
         """
-        try:
-            # 使用工厂创建git操作实例
-            git_ops = GitOperationsFactory.create(repo_url)
-            
-            # 先从git获取引用对应的commit id
-            repo = git_ops._clone_repository(repo_url)
-            start_commit = git_ops._get_commit_object(repo, start_ref)
-            end_commit = git_ops._get_commit_object(repo, end_ref)
-            
-            # 尝试从数据库获取
-            commits = self.db.get_commits_between(
-                repo_url,
-                str(start_commit.id),
-                str(end_commit.id)
-            )
-            
-            if commits:
-                return commits
-                
-            # 数据库中不存在，从git获取
-            commits = git_ops.get_commits_between(
-                repo_url,
-                start_ref,
-                end_ref
-            )
-            
-            # 同步到数据库
-            self.db.save_commits(repo_url, commits)
-            return commits
-            
-        except Exception as e:
-            # 如果数据库查询失败，直接从git获取
-            return git_ops.get_commits_between(
-                repo_url,
-                start_ref,
-                end_ref
-            )
+        # 两个引用都是完整的commit id时先查询数据库，命中时无需克隆或拉取仓库
+        db_checked = False
+        db_available = True
+        if COMMIT_ID_PATTERN.fullmatch(start_ref) and COMMIT_ID_PATTERN.fullmatch(end_ref):
+            try:
+                commits = self.db.get_commits_between(repo_url, start_ref.lower(), end_ref.lower())
+                if commits:
+                    return commits
+                db_checked = True
+            except DATABASE_ERRORS:
+                db_available = False
+
+        # 使用工厂创建git操作实例
+        git_ops = GitOperationsFactory.create(repo_url)
+
+        # 先从git获取引用对应的commit id，引用无效时直接抛出异常
+        repo, (start_commit, end_commit) = git_ops._open_refs(repo_url, (start_ref, end_ref))
+
+        if db_available and not db_checked:
+            try:
+                # 尝试从数据库获取
+                commits = self.db.get_commits_between(
+                    repo_url,
+                    str(start_commit.id),
+                    str(end_commit.id)
+                )
+                if commits:
+                    return commits
+            except DATABASE_ERRORS:
+                db_available = False
+
+        with _single_flight((repo_url, str(start_commit.id), str(end_commit.id))) as waited:
+            if waited and db_available:
+                # 其他请求已经完成了相同范围的遍历，结果已写入数据库
+                try:
+                    commits = self.db.get_commits_between(
+                        repo_url,
+                        str(start_commit.id),
+                        str(end_commit.id)
+                    )
+                    if commits:
+                        return commits
+                except DATABASE_ERRORS:
+                    db_available = False
+
+            # 数据库中不存在，使用已解析的提交从git获取
+            commits = git_ops._get_commits_between_ids(repo, start_commit, end_commit)
+
+            # 同步到数据库，写入失败不影响本次查询结果；数据库查询失败时不再尝试同步
+            if db_available:
+                try:
+                    self.db.save_commits(repo_url, commits)
+                except DATABASE_ERRORS:
+                    pass
+        return commits
 
     def get_commits_by_depth(
         self,
@@ -70,43 +170,91 @@ class GitQueryService:
         获取指定深度的提交
         优先从数据库查询，如果数据不存在则从git仓库获取并同步到数据库
         """
-        try:
-            # 使用工厂创建git操作实例
-            git_ops = GitOperationsFactory.create(repo_url)
-            
-            # 先从git获取引用对应的commit id
-            repo = git_ops._clone_repository(repo_url)
-            start_commit = git_ops._get_commit_object(repo, start_ref)
-            
-            # 尝试从数据库获取
-            commits = self.db.get_commits_by_depth(
-                repo_url,
-                str(start_commit.id),
-                max_depth
-            )
-            
-            if commits:
-                return commits
-                
-            # 数据库中不存在，从git获取
-            commits = git_ops.get_commits_by_depth(
-                repo_url,
-                start_ref,
-                max_depth
-            )
-            
-            # 同步到数据库
-            self.db.save_commits(repo_url, commits)
-            return commits
-            
-        except Exception as e:
-            # 如果数据库查询失败，直接从git获取
-            return git_ops.get_commits_by_depth(
+        # 使用工厂创建git操作实例
+        git_ops = GitOperationsFactory.create(repo_url)
+
+        # 起始引用是完整的commit id时先查询数据库，命中时无需克隆或拉取仓库
+        db_checked = False
+        db_available = True
+        if COMMIT_ID_PATTERN.fullmatch(start_ref):
+            try:
+                commits = self.db.get_commits_by_depth(repo_url, start_ref.lower(), max_depth)
+                if commits:
+                    return commits
+                db_checked = True
+            except DATABASE_ERRORS:
+                db_available = False
+
+        if db_available and not db_checked:
+            # 先从git获取引用对应的commit id，有限深度时只需浅克隆；引用无效时直接抛出异常
+            repo, start_commit = git_ops._open_ref(
                 repo_url,
                 start_ref,
-                max_depth
+                depth=git_ops._shallow_depth(max_depth)
             )
 
+            try:
+                # 尝试从数据库获取
+                commits = self.db.get_commits_by_depth(
+                    repo_url,
+                    str(start_commit.id),
+                    max_depth
+                )
+                if commits:
+                    return commits
+            except DATABASE_ERRORS:
+                db_available = False
+
+        # 数据库中不存在，从git获取
+        commits = git_ops.get_commits_by_depth(
+            repo_url,
+            start_ref,
+            max_depth
+        )
+
+        # 同步到数据库，写入失败不影响本次查询结果；数据库查询失败时不再尝试同步
+        if db_available:
+            try:
+                self.db.save_commits(repo_url, commits)
+            except DATABASE_ERRORS:
+                pass
+        return commits
+
+    def bulk_get_commits(
+        self,
+        repo_urls: List[str],
+        start_ref: str,
+        max_depth: int = -1,
+        max_workers: Optional[int] = None
+    ) -> Dict[str, List[Dict[str, Union[str, int, List[str]]]]]:
+        """
+        使用多进程并行获取多个仓库指定深度的提交
+        遍历和构造提交信息是CPU密集的Python代码，多进程可以利用多个CPU核心
+
+        :param repo_urls: 仓库URL列表
+        :param start_ref: 起始引用（分支名、tag名或commit id）
+        :param max_depth: 最大深度，-1表示不限制深度
+        :param max_workers: 最大进程数，默认为CPU核心数
+        :return: 仓库URL到提交信息列表的映射
+        """
+        # 按仓库缓存键去重，避免多个进程同时克隆同一个仓库到相同的缓存目录
+        keys = list(dict.fromkeys(repo_url.rstrip('/') for repo_url in repo_urls))
+        if not keys:
+            return {}
+
+        workers = min(max_workers or os.cpu_count() or 1, len(keys))
+        # 子进程共用一个临时缓存目录，各仓库的子目录互不相同；进程池关闭后再删除目录
+        # 服务进程中有多个线程，使用 spawn 启动子进程，避免 fork 时复制其他线程持有的锁
+        with tempfile.TemporaryDirectory(prefix='git_query_bulk_') as cache_root, ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        ) as pool:
+            results = dict(zip(keys, pool.map(
+                _get_commits_by_depth_worker,
+                [(key, start_ref, max_depth, cache_root) for key in keys]
+            )))
+        return {repo_url: results[repo_url.rstrip('/')] for repo_url in repo_urls}
+
     def get_first_commit(self, repo_url: str) -> Dict[str, Union[str, int, List[str]]]:
         """
         获取仓库的第一个提交节点
@@ -133,8 +281,31 @@ class GitQueryService:
     ) -> Dict[str, Union[str, int, List[str]]]:
         """
         快速查询单个提交信息
-        优先从数据库查询，如果数据不存在则从git仓库获取并同步到数据库
+        优先使用进程内缓存，其次从数据库查询，如果数据不存在则从git仓库获取并同步到数据库
         """
+        key = (repo_url, commit_id)
+        with _commit_cache_lock:
+            commit = _commit_cache.get(key)
+            if commit is not None:
+                _commit_cache.move_to_end(key)
+
+        if commit is None:
+            commit = self._load_commit_by_id(repo_url, commit_id)
+            if COMMIT_CACHE_SIZE > 0:
+                with _commit_cache_lock:
+                    _commit_cache[key] = commit
+                    while len(_commit_cache) > COMMIT_CACHE_SIZE:
+                        _commit_cache.popitem(last=False)
+
+        # 返回副本，调用方修改结果不会影响缓存
+        return {**commit, "parents": list(commit["parents"])}
+
+    def _load_commit_by_id(
+        self,
+        repo_url: str,
+        commit_id: str
+    ) -> Dict[str, Union[str, int, List[str]]]:
+        """从数据库或git仓库读取单个提交信息"""
         try:
             # 先尝试从数据库获取
             commit = self.db.get_commit_by_id(repo_url, commit_id)
@@ -143,17 +314,17 @@ class GitQueryService:
 
             # 数据库中不存在，从git获取
             git_ops = GitOperationsFactory.create(repo_url)
-            repo = git_ops._clone_repository(repo_url)
+            repo = git_ops._clone_repository(repo_url, commit_ids=(commit_id,))
             
             try:
                 commit_obj = repo.get(commit_id)
-                if commit_obj and commit_obj.type == pygit2.GIT_OBJ_COMMIT:
+                if commit_obj and commit_obj.type == ObjectType.COMMIT:
                     commit = {
                         "id": str(commit_obj.id),
                         "message": commit_obj.message,
                         "author": commit_obj.author.name,
                         "time": commit_obj.commit_time,
-                        "parents": [str(parent.id) for parent in commit_obj.parents],
+                        "parents": [str(parent_id) for parent_id in commit_obj.parent_ids],
                         "depth": 0  # 单个提交查询时深度设为0
                     }
                     # 同步到数据库
@@ -183,43 +354,86 @@ class GitQueryService:
         :return: 同步的提交总数
         """
         try:
-            git_ops = GitOperationsFactory.create(repo_url)
-            repo = git_ops._clone_repository(repo_url)
-            
-            total_synced = 0
-            current_commit_id = commit_id
-            
-            while True:
-                # 检查当前提交是否已存在于数据库
-                if self.db.get_commit_by_id(repo_url, current_commit_id):
-                    break
-                
-                # 获取一批提交
-                commits = git_ops.get_commit_batch_with_parents(
-                    repo,
-                    current_commit_id,
-                    batch_size
+            # 同一起点的并发同步串行执行，后执行的同步发现起始提交已存在时直接返回；
+            # 查询和写入各复用一个会话；会话不是线程安全的，每个会话同一时间只在一个线程中使用
+            with _single_flight((repo_url, commit_id)), \
+                    self.db.session() as read_session, \
+                    self.db.session() as write_session:
+                return self._sync_commit_history(
+                    repo_url,
+                    commit_id,
+                    batch_size,
+                    read_session,
+                    write_session
                 )
-                
-                if not commits:
-                    break
-                
-                # 保存到数据库
-                self.db.save_commits(repo_url, commits)
-                total_synced += len(commits)
-                
-                # 获取最后一个提交的父提交作为下一批的起点
-                last_commit = commits[-1]
-                if not last_commit["parents"]:
-                    break  # 到达仓库起始点
-                    
-                current_commit_id = last_commit["parents"][0]
-            
-            return total_synced
-            
         except Exception as e:
             raise ValueError(f"同步提交历史失败: {str(e)}")
 
+    def _sync_commit_history(
+        self,
+        repo_url: str,
+        commit_id: str,
+        batch_size: int,
+        read_session: Session,
+        write_session: Session
+    ) -> int:
+        """使用给定的会话同步提交历史"""
+        # 检查起始提交是否已同步，已同步时无需克隆或拉取仓库；
+        # 查询接口保存的单个提交或截断的历史不算已同步，其祖先可能不在数据库中
+        if self.db.get_synced_commit_ids(repo_url, [commit_id], session=read_session):
+            return 0
+
+        git_ops = GitOperationsFactory.create(repo_url)
+        repo = git_ops._clone_repository(repo_url, commit_ids=(commit_id,))
+
+        # 已同步的提交，其祖先必然也已同步，遍历到时无需再向上追溯
+        known_ids = set()
+        total_synced = 0
+
+        # 写入数据库与遍历后续提交并行执行，写入由单个线程按顺序完成，
+        # 最多 SYNC_PENDING_WRITES 批排队，使遍历不必等待每一批写入完成；
+        # 遍历的批次较小时先累积到 SAVE_BATCH_SIZE 再写入，减少事务提交次数
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = deque()
+            buffered = []
+            for commits in git_ops.iter_commit_batches(
+                repo,
+                commit_id,
+                batch_size,
+                known_ids
+            ):
+                # 批量检查下一批待遍历的父提交是否已同步
+                batch_ids = {commit["id"] for commit in commits}
+                frontier = {
+                    parent_id
+                    for commit in commits
+                    for parent_id in commit["parents"]
+                } - batch_ids - known_ids
+                known_ids.update(
+                    self.db.get_synced_commit_ids(repo_url, frontier, session=read_session)
+                )
+
+                buffered.extend(commits)
+                total_synced += len(commits)
+                if len(buffered) < SAVE_BATCH_SIZE:
+                    continue
+
+                # 在后台保存累积的批次，排队过多时等待最早的一批写入完成
+                pending.append(
+                    executor.submit(self.db.save_commits, repo_url, buffered, write_session, synced=True)
+                )
+                buffered = []
+                if len(pending) > SYNC_PENDING_WRITES:
+                    pending.popleft().result()
+
+            # 剩余的批次在所有后台写入完成后写入，写入会话不会被两个线程同时使用
+            while pending:
+                pending.popleft().result()
+            if buffered:
+                self.db.save_commits(repo_url, buffered, write_session, synced=True)
+
+        return total_synced
+
     def delete_repository(self, repo_url: str) -> Dict[str, Union[int, str]]:
         """
         删除仓库的所有信息
@@ -229,6 +443,9 @@ class GitQueryService:
         """
         try:
             deleted_count = self.db.delete_repository(repo_url)
+            with _commit_cache_lock:
+                for key in [key for key in _commit_cache if key[0] == repo_url]:
+                    del _commit_cache[key]
             return {
                 "deleted_commits": deleted_count,
                 "repository_url": repo_url,
@@ -242,4 +459,5 @@ class GitQueryService:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.db.close() 
\ No newline at end of file
+        if self._db is not None:
+            self._db.close() 
\ No newline at end of file
@@ -6,10 +6,11 @@ setup(
     packages=find_packages(),
     install_requires=[
         "fastapi",
-        "uvicorn",
+        "uvicorn[standard]",
         "pygit2",
         "neo4j",
         "python-dotenv",
+        "orjson",
     ],
     extras_require={
         "test": [
@@ -17,6 +18,7 @@ setup(
             "pytest-cov",
             "httpx",
             "pytest-asyncio",
+            "pytest-xdist",
         ],
     },
 ) 
\ No newline at end of file
@@ -1,4 +1,5 @@
 import pygit2
+import subprocess
 from pygit2.enums import ObjectType
 
 def fetch_tag_ancestors(remote_url, tag_name, depth=1):
@@ -13,14 +14,22 @@ def fetch_tag_ancestors(remote_url, tag_name, depth=1):
     # 设置临时路径，pygit2 会在内存中创建虚拟仓库
     repo_path = './temp_repo'
 
-    # 克隆仓库 (浅克隆)
-    callbacks = pygit2.RemoteCallbacks()  # 配置认证方式，如需要可以扩展
-    repo = pygit2.clone_repository(
-        remote_url,
-        repo_path,
-        bare=True,
-        callbacks=callbacks
-    )
+    # 只需要提交信息，使用不下载文件内容的部分克隆；git 不可用时退回 libgit2 完整克隆
+    try:
+        subprocess.run(
+            ['git', 'clone', '--bare', '--quiet', '--filter=blob:none', '--', remote_url, repo_path],
+            check=True,
+            capture_output=True
+        )
+        repo = pygit2.Repository(repo_path)
+    except (OSError, subprocess.CalledProcessError):
+        callbacks = pygit2.RemoteCallbacks()  # 配置认证方式，如需要可以扩展
+        repo = pygit2.clone_repository(
+            remote_url,
+            repo_path,
+            bare=True,
+            callbacks=callbacks
+        )
     
     # 获取指定 tag 的引用
     tag_ref = f'refs/tags/{tag_name}'
@@ -38,28 +47,17 @@ def fetch_tag_ancestors(remote_url, tag_name, depth=1):
     else:
         raise ValueError("Tag does not point to a commit or tag object")
 
-    # 遍历祖先
+    # 使用 libgit2 的 revwalk 遍历祖先，去重和遍历都在 C 中完成
     ancestor_commits = []
-    visited = set()
-    stack = [target_commit]
-
-    while stack:
-        commit = stack.pop()
-        if commit.id in visited:
-            continue
-
-        visited.add(commit.id)
+    for commit in repo.walk(target_commit.id, pygit2.GIT_SORT_TOPOLOGICAL):
         ancestor_commits.append({
             "id": str(commit.id),
             "message": commit.message,
             "author": commit.author.name,
             "time": commit.commit_time,
-            "parents": [str(parent.id) for parent in commit.parents]
+            "parents": [str(parent_id) for parent_id in commit.parent_ids]
         })
 
-        # 添加父节点到堆栈
-        stack.extend(commit.parents)
-
     return ancestor_commits
 
 
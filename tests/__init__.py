@@ -1,3 +1,9 @@
 """
 Test package for git-query-service
-""" 
\ No newline at end of file
+""" 
+
+import orjson
+
+def response_json(response):
+    """使用 orjson 解析响应内容，比 response.json() 使用的标准库 json 更快"""
+    return orjson.loads(response.content)
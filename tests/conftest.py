@@ -20,6 +20,15 @@ def pytest_configure(config):
     else:
         raise RuntimeError(f"测试环境配置文件不存在: {env_file}")
 
+def pytest_collection_modifyitems(config, items):
+    """
+    将访问数据库或克隆远程仓库的测试标记为集成测试
+    这些测试共用同一个数据库并会清空数据，不能与其他测试并行执行
+    """
+    for item in items:
+        if item.get_closest_marker('database') is not None or 'cloned_repo' in item.fixturenames:
+            item.add_marker(pytest.mark.integration)
+
 @pytest.fixture(scope="session")
 def neo4j_connection():
     """
@@ -33,21 +42,27 @@ def neo4j_connection():
     yield db
     db.close()
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def test_client():
     """
     提供测试用的 FastAPI 客户端
+    整个测试会话只启动一次应用，共用启动时创建的Neo4j驱动
     """
     with TestClient(app) as client:
         yield client
 
 @pytest.fixture(autouse=True)
-def setup_test_environment(neo4j_connection):
+def setup_test_environment(request):
     """
     设置测试环境，每个测试前自动运行
     """
-    # 在这里可以添加测试前的准备工作
+    # 只有标记了 database 的测试会写入数据库，其他测试使用模拟对象，无需连接数据库和清理
+    neo4j_connection = None
+    if request.node.get_closest_marker('database') is not None:
+        neo4j_connection = request.getfixturevalue('neo4j_connection')
     yield
+    if neo4j_connection is None:
+        return
     # 测试后清理数据库
     with neo4j_connection._driver.session() as session:
         session.run("MATCH (n) DETACH DELETE n")
@@ -1,18 +1,30 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
+from httpx import AsyncClient, ASGITransport
 from git_query.api import app
-import json
-from typing import List, Dict
+from git_query import git_operations
+from git_query.db import GitDatabase
+from git_query.factory import GitOperationsFactory
+from git_query.query import GitQueryService
+from tests import response_json
+import re
+import subprocess
 from unittest.mock import patch, MagicMock
-from datetime import datetime
 
+# 只使用模拟对象的测试不使用 conftest 中会话级的 test_client：其启动过程会连接 Neo4j，
+# 不进入 lifespan 的客户端不会连接数据库；访问数据库或远程仓库的测试单独标记 database
 client = TestClient(app)
 
 # 测试数据
 TEST_REPO = "https://github.com/libgit2/pygit2.git"
 VALID_TAGS = ["v1.4.0", "v1.3.0"]
 INVALID_TAG = "v999.999.0"
+# git 返回的commit id为40个小写十六进制字符
+COMMIT_ID_FORMAT = re.compile(r"[0-9a-f]{40}")
 VALID_COMMIT = "57b03b8d4a1f8b214f6ce5f0f6dfd35918b46399"
+# 本地未监听的端口，克隆时立即被拒绝连接，无需等待DNS解析和远程响应
+UNREACHABLE_REPO = "http://127.0.0.1:1/nope.git"
 
 # 模拟提交数据
 MOCK_COMMITS = [
@@ -20,7 +32,7 @@ MOCK_COMMITS = [
         "id": "commit1",
         "message": "First commit",
         "author": "Test Author",
-        "time": int(datetime.now().timestamp()),
+        "time": 1234567890,
         "parents": [],
         "depth": 0
     },
@@ -28,15 +40,23 @@ MOCK_COMMITS = [
         "id": "commit2",
         "message": "Second commit",
         "author": "Test Author",
-        "time": int(datetime.now().timestamp()),
+        "time": 1234567891,
         "parents": ["commit1"],
         "depth": 1
     }
 ]
 
-def test_get_commits_between_valid_tags():
+@pytest.fixture(scope="session")
+def cloned_repo(tmp_path_factory):
+    """整个测试会话只克隆一次测试仓库，之后的请求复用进程内的仓库缓存"""
+    with patch.object(git_operations, 'CACHE_ROOT', tmp_path_factory.mktemp('repo-cache')):
+        GitOperationsFactory.create(TEST_REPO)._clone_repository(TEST_REPO)
+        yield TEST_REPO
+
+@pytest.mark.database
+def test_get_commits_between_valid_tags(cloned_repo, test_client):
     """测试使用有效的tag获取提交信息"""
-    response = client.get(
+    response = test_client.get(
         "/commits/",
         params={
             "repo_url": TEST_REPO,
@@ -46,7 +66,7 @@ def test_get_commits_between_valid_tags():
     )
     
     assert response.status_code == 200
-    commits = response.json()
+    commits = response_json(response)
     assert isinstance(commits, list)
     assert len(commits) > 0
     
@@ -56,9 +76,10 @@ def test_get_commits_between_valid_tags():
         "id", "message", "author", "time", "parents", "depth"
     ])
 
-def test_get_commits_with_invalid_tag():
+@pytest.mark.database
+def test_get_commits_with_invalid_tag(cloned_repo, test_client):
     """测试使用无效的tag"""
-    response = client.get(
+    response = test_client.get(
         "/commits/",
         params={
             "repo_url": TEST_REPO,
@@ -68,11 +89,12 @@ def test_get_commits_with_invalid_tag():
     )
     
     assert response.status_code == 400
-    assert INVALID_TAG in response.json()["detail"]
+    assert INVALID_TAG in response_json(response)["detail"]
 
-def test_get_commits_with_commit_id():
+@pytest.mark.database
+def test_get_commits_with_commit_id(cloned_repo, test_client):
     """测试使用commit id作为引用"""
-    response = client.get(
+    response = test_client.get(
         "/commits/",
         params={
             "repo_url": TEST_REPO,
@@ -82,16 +104,17 @@ def test_get_commits_with_commit_id():
     )
     
     assert response.status_code == 200
-    commits = response.json()
+    commits = response_json(response)
     assert isinstance(commits, list)
     assert len(commits) > 0
 
-def test_get_commits_with_invalid_repo():
+@pytest.mark.database
+def test_get_commits_with_invalid_repo(test_client):
     """测试使用无效的仓库地址"""
-    response = client.get(
+    response = test_client.get(
         "/commits/",
         params={
-            "repo_url": "https://github.com/nonexistent/repo.git",
+            "repo_url": UNREACHABLE_REPO,
             "start_ref": VALID_TAGS[0],
             "end_ref": VALID_TAGS[1]
         }
@@ -99,37 +122,10 @@ def test_get_commits_with_invalid_repo():
     
     assert response.status_code == 400
 
-def test_commits_response_structure():
-    """测试返回的提交信息结构"""
-    response = client.get(
-        "/commits/",
-        params={
-            "repo_url": TEST_REPO,
-            "start_ref": VALID_TAGS[0],
-            "end_ref": VALID_TAGS[1]
-        }
-    )
-    
-    assert response.status_code == 200
-    commits = response.json()
-    
-    for commit in commits:
-        assert isinstance(commit["id"], str)
-        assert isinstance(commit["message"], str)
-        assert isinstance(commit["author"], str)
-        assert isinstance(commit["time"], int)
-        assert isinstance(commit["parents"], list)
-        assert isinstance(commit["depth"], int)
-        
-        # 验证commit id的格式（40个十六进制字符）
-        assert len(commit["id"]) == 40
-        int(commit["id"], 16)  # 确保是有效的十六进制
-
-    assert len(commits) == 22
-
-def test_commits_depth_order():
+@pytest.mark.database
+def test_commits_depth_order(cloned_repo, test_client):
     """测试提交的深度是否正确递增"""
-    response = client.get(
+    response = test_client.get(
         "/commits/",
         params={
             "repo_url": TEST_REPO,
@@ -139,25 +135,42 @@ def test_commits_depth_order():
     )
     
     assert response.status_code == 200
-    commits = response.json()
+    commits = response_json(response)
     
     # 验证深度值是否合理
     assert commits[0]["depth"] == 0  # 第一个提交的深度应该是0
     for i in range(1, len(commits)):
         assert commits[i]["depth"] >= commits[i-1]["depth"]
 
-@pytest.mark.parametrize("params", [
-    {},  # 缺少所有参数
-    {"repo_url": TEST_REPO},  # 缺少引用参数
-    {"repo_url": TEST_REPO, "start_ref": VALID_TAGS[0]},  # 缺少end_ref
-    {"start_ref": VALID_TAGS[0], "end_ref": VALID_TAGS[1]},  # 缺少repo_url
-])
-def test_missing_parameters(params):
+def test_missing_parameters():
     """测试缺少必要参数的情况"""
-    response = client.get("/commits/", params=params)
-    assert response.status_code == 422  # FastAPI的参数验证错误码 
+    for params in [
+        {},  # 缺少所有参数
+        {"repo_url": TEST_REPO},  # 缺少引用参数
+        {"repo_url": TEST_REPO, "start_ref": VALID_TAGS[0]},  # 缺少end_ref
+        {"start_ref": VALID_TAGS[0], "end_ref": VALID_TAGS[1]},  # 缺少repo_url
+    ]:
+        response = client.get("/commits/", params=params)
+        assert response.status_code == 422, params  # FastAPI的参数验证错误码
+
+@pytest.fixture
+def mock_open_ref():
+    """模拟解析起始引用，按深度查询的测试不克隆远程仓库"""
+    with patch(
+        'git_query.git_operations.GitOperations._open_ref',
+        return_value=(MagicMock(), MagicMock(id='commit1'))
+    ) as mock:
+        yield mock
+
+@pytest.fixture
+def mock_db():
+    """模拟数据库，按深度查询的测试在数据库中查不到提交，从git获取"""
+    with patch('git_query.query.GitDatabase') as mock:
+        mock.return_value = MagicMock(spec=GitDatabase)
+        mock.return_value.get_commits_by_depth.return_value = []
+        yield mock.return_value
 
-def test_get_commits_by_depth_success():
+def test_get_commits_by_depth_success(mock_open_ref, mock_db):
     """测试成功获取指定深度的提交"""
     with patch('git_query.git_operations.GitOperations.get_commits_by_depth', return_value=MOCK_COMMITS):
         response = client.post(
@@ -170,13 +183,13 @@ def test_get_commits_by_depth_success():
         )
         
         assert response.status_code == 200
-        data = response.json()
+        data = response_json(response)
         assert "id" in data[0]
         assert len(data) == 2
         assert data[0]["id"] == "commit1"
         assert data[1]["id"] == "commit2"
 
-def test_get_commits_by_depth_unlimited():
+def test_get_commits_by_depth_unlimited(mock_open_ref, mock_db):
     """测试不限制深度获取提交"""
     with patch('git_query.git_operations.GitOperations.get_commits_by_depth', return_value=MOCK_COMMITS):
         response = client.post(
@@ -189,10 +202,10 @@ def test_get_commits_by_depth_unlimited():
         )
         
         assert response.status_code == 200
-        data = response.json()
+        data = response_json(response)
         assert len(data) == 2
 
-def test_get_commits_by_depth_invalid_ref():
+def test_get_commits_by_depth_invalid_ref(mock_open_ref, mock_db):
     """测试使用无效的引用"""
     with patch('git_query.git_operations.GitOperations.get_commits_by_depth', 
               side_effect=ValueError("Invalid reference")):
@@ -206,9 +219,9 @@ def test_get_commits_by_depth_invalid_ref():
         )
         
         assert response.status_code == 400
-        assert "Invalid reference" in response.json()["detail"]
+        assert "Invalid reference" in response_json(response)["detail"]
 
-def test_get_commits_by_depth_server_error():
+def test_get_commits_by_depth_server_error(mock_open_ref, mock_db):
     """测试服务器错误情况"""
     with patch('git_query.git_operations.GitOperations.get_commits_by_depth', 
               side_effect=Exception("Server error")):
@@ -222,32 +235,23 @@ def test_get_commits_by_depth_server_error():
         )
         
         assert response.status_code == 500
-        assert "Server error" in response.json()["detail"]
+        assert "Server error" in response_json(response)["detail"]
 
-def test_get_commits_by_depth_invalid_depth():
-    """测试无效的深度值"""
-    response = client.post(
-        "/commits/by-depth",
-        json={
+def test_get_commits_by_depth_invalid_request():
+    """测试无效的深度值和缺少必需的URL参数"""
+    for request in [
+        {
             "remote_url": "https://github.com/test/repo.git",
             "start_ref": "main",
             "max_depth": "invalid"  # 应该是整数
-        }
-    )
-    
-    assert response.status_code == 422  # FastAPI的验证错误状态码
-
-def test_get_commits_by_depth_missing_url():
-    """测试缺少必需的URL参数"""
-    response = client.post(
-        "/commits/by-depth",
-        json={
-            "start_ref": "main",
+        },
+        {
+            "start_ref": "main",  # 缺少remote_url
             "max_depth": 1
-        }
-    )
-    
-    assert response.status_code == 422
+        },
+    ]:
+        response = client.post("/commits/by-depth", json=request)
+        assert response.status_code == 422, request  # FastAPI的验证错误状态码
 
 def test_cors_preflight():
     """测试 CORS 预检请求"""
@@ -267,88 +271,121 @@ def test_cors_preflight():
 
 def test_cors_actual_request():
     """测试带有 CORS 头的实际请求"""
+    # CORS 头由中间件添加，与接口结果无关；缺少引用参数的请求在参数校验时返回，不访问git仓库
     response = client.get(
         "/commits/",
         headers={"Origin": "http://example.com"},
-        params={
-            "repo_url": TEST_REPO,
-            "start_ref": VALID_TAGS[0],
-            "end_ref": VALID_TAGS[1]
-        }
+        params={"repo_url": TEST_REPO}
     )
     
-    assert response.status_code == 200
+    assert response.status_code == 422
     assert response.headers["access-control-allow-origin"] == "*"
 
-def test_get_first_commit():
-    """测试获取仓库的第一个提交"""
-    response = client.get(
-        "/commits/first",
-        params={"repo_url": TEST_REPO}
+@pytest.fixture
+def anyio_backend():
+    """异步测试使用 asyncio 运行"""
+    return "asyncio"
+
+@pytest.fixture
+async def async_client():
+    """提供异步客户端，用于并发请求相互独立的接口"""
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+@pytest.mark.database
+@pytest.mark.anyio
+async def test_commit_endpoints(cloned_repo, async_client):
+    """并发请求提交范围、第一个提交和单个提交接口，测试返回的提交信息结构"""
+    commits_response, first_response, commit_response = await asyncio.gather(
+        async_client.get(
+            "/commits/",
+            params={
+                "repo_url": TEST_REPO,
+                "start_ref": VALID_TAGS[0],
+                "end_ref": VALID_TAGS[1]
+            }
+        ),
+        async_client.get("/commits/first", params={"repo_url": TEST_REPO}),
+        async_client.get(f"/commits/{VALID_COMMIT}", params={"repo_url": TEST_REPO})
     )
-    
-    assert response.status_code == 200
-    commit = response.json()
-    
+
+    assert commits_response.status_code == 200
+    commits = response_json(commits_response)
+    for commit in commits:
+        assert isinstance(commit["id"], str)
+        assert isinstance(commit["message"], str)
+        assert isinstance(commit["author"], str)
+        assert isinstance(commit["time"], int)
+        assert isinstance(commit["parents"], list)
+        assert isinstance(commit["depth"], int)
+
+        # 验证commit id的格式（40个十六进制字符）
+        assert COMMIT_ID_FORMAT.fullmatch(commit["id"])
+    # 结果为 start_ref 可达、end_ref 不可达的提交加上 end_ref 本身，与 git rev-list 的计数对照
+    repo = GitOperationsFactory.create(TEST_REPO)._clone_repository(TEST_REPO)
+    rev_list = subprocess.run(
+        ["git", "rev-list", "--count", VALID_TAGS[0], f"^{VALID_TAGS[1]}"],
+        cwd=repo.path, capture_output=True, text=True, check=True
+    )
+    assert len(commits) == int(rev_list.stdout) + 1
+
+    assert first_response.status_code == 200
+    first_commit = response_json(first_response)
     # 验证返回的提交信息格式
+    assert all(key in first_commit for key in [
+        "id", "message", "author", "time", "parents", "depth"
+    ])
+    # 第一个提交没有父提交，深度应该为0
+    assert first_commit["parents"] == []
+    assert first_commit["depth"] == 0
+
+    assert commit_response.status_code == 200
+    commit = response_json(commit_response)
     assert all(key in commit for key in [
         "id", "message", "author", "time", "parents", "depth"
     ])
-    # 第一个提交没有父提交
-    assert commit["parents"] == []
-    # 深度应该为0
-    assert commit["depth"] == 0
+    assert commit["id"] == VALID_COMMIT
 
-def test_get_first_commit_invalid_repo():
+@pytest.mark.database
+def test_get_first_commit_invalid_repo(test_client):
     """测试获取无效仓库的第一个提交"""
-    response = client.get(
+    response = test_client.get(
         "/commits/first",
-        params={"repo_url": "https://github.com/nonexistent/repo.git"}
+        params={"repo_url": UNREACHABLE_REPO}
     )
     
     assert response.status_code == 400
 
-def test_get_commit_by_id():
-    """测试获取单个提交信息"""
-    response = client.get(
-        f"/commits/{VALID_COMMIT}",
-        params={"repo_url": TEST_REPO}
-    )
-    
-    assert response.status_code == 200
-    commit = response.json()
-    
-    # 验证返回的提交信息格式
-    assert all(key in commit for key in [
-        "id", "message", "author", "time", "parents", "depth"
-    ])
-    assert commit["id"] == VALID_COMMIT
-
-def test_get_commit_by_invalid_id():
+@pytest.mark.database
+def test_get_commit_by_invalid_id(cloned_repo, test_client):
     """测试获取不存在的提交ID"""
     invalid_commit = "0" * 40  # 40个0作为无效的commit id
-    response = client.get(
+    response = test_client.get(
         f"/commits/{invalid_commit}",
         params={"repo_url": TEST_REPO}
     )
     
     assert response.status_code == 400
-    assert "提交ID不存在" in response.json()["detail"]
+    assert "提交ID不存在" in response_json(response)["detail"]
 
-def test_delete_repository():
-    """测试删除仓库信息"""
-    # 首先添加一些提交数据
+@pytest.fixture
+def synced_repo(cloned_repo):
+    """同步测试仓库的提交历史，测试结束后由 conftest 清空数据库"""
     with GitQueryService() as query_service:
         query_service.sync_commit_history(TEST_REPO, VALID_COMMIT)
-    
-    # 然后删除仓库
-    response = client.delete(
+    yield TEST_REPO
+
+@pytest.mark.database
+def test_delete_repository(synced_repo, test_client, neo4j_connection):
+    """测试删除仓库信息"""
+    # 删除已同步的仓库
+    response = test_client.delete(
         "/repository",
         params={"repo_url": TEST_REPO}
     )
     
     assert response.status_code == 200
-    result = response.json()
+    result = response_json(response)
     
     # 验证响应格式
     assert all(key in result for key in [
@@ -359,20 +396,19 @@ def test_delete_repository():
     ])
     assert result["repository_url"] == TEST_REPO
     assert result["status"] == "success"
-    assert result["deleted_commits"] >= 0
+    assert result["deleted_commits"] > 0
 
-    # 验证仓库确实被删除了
-    with GitQueryService() as query_service:
-        commit = query_service.get_commit_by_id(TEST_REPO, VALID_COMMIT)
-        assert commit is None
+    # 验证仓库确实被删除了；查询服务在数据库中查不到时会从git读取，需直接查询数据库
+    assert neo4j_connection.get_commit_by_id(TEST_REPO, VALID_COMMIT) is None
 
-def test_delete_nonexistent_repository():
+@pytest.mark.database
+def test_delete_nonexistent_repository(test_client):
     """测试删除不存在的仓库"""
-    response = client.delete(
+    response = test_client.delete(
         "/repository",
         params={"repo_url": "https://github.com/nonexistent/repo.git"}
     )
     
     assert response.status_code == 200
-    result = response.json()
+    result = response_json(response)
     assert result["deleted_commits"] == 0
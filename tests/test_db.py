@@ -1,3 +1,8 @@
+import pytest
+from git_query.query import GitQueryService
+
+pytestmark = pytest.mark.database
+
 def test_save_commits(neo4j_connection, mock_repo_url, mock_commits):
     """测试保存提交信息到数据库"""
     # 保存提交信息
@@ -98,4 +103,83 @@ def test_incremental_commits(neo4j_connection, mock_repo_url):
     assert commits_between[1]["parents"] == ["commit_old_2"]
     assert commits_between[2]["parents"] == ["commit_old_1"]
     assert commits_between[3]["parents"] == []
-    
\ No newline at end of file
+    
+def test_get_commits_between_includes_merged_branches(neo4j_connection, mock_repo_url):
+    """测试两个提交之间的结果包含合并进来的分支，不包含结束提交的祖先，与git的结果一致"""
+    def commit(commit_id, parents, depth):
+        return {
+            "id": commit_id,
+            "message": commit_id,
+            "author": "Test Author",
+            "time": 1234567890,
+            "parents": parents,
+            "depth": depth
+        }
+
+    # merge 合并了 side，两个分支都从 base 分出
+    merge = commit("merge", ["main", "side"], 0)
+    neo4j_connection.save_commits(mock_repo_url, [merge])
+    # 分支上的提交尚未保存时数据库中的范围不完整
+    assert neo4j_connection.get_commits_between(mock_repo_url, "merge", "main") == []
+
+    neo4j_connection.save_commits(mock_repo_url, [
+        commit("main", ["base"], 1),
+        commit("side", ["base"], 1),
+        commit("base", [], 2),
+    ])
+    commits = neo4j_connection.get_commits_between(mock_repo_url, "merge", "main")
+
+    assert {commit["id"]: commit["depth"] for commit in commits} == {"merge": 0, "main": 1, "side": 1}
+    assert commits[0]["id"] == "merge"
+
+def test_save_commits_across_calls_keeps_parent_edges(neo4j_connection, mock_repo_url, mock_commits):
+    """测试子提交先于父提交保存时父子关系不丢失"""
+    # 先保存子提交，再保存父提交
+    neo4j_connection.save_commits(mock_repo_url, [mock_commits[1]])
+    neo4j_connection.save_commits(mock_repo_url, [mock_commits[0]])
+
+    saved_commits = neo4j_connection.get_commits_by_depth(
+        mock_repo_url,
+        mock_commits[1]["id"]
+    )
+    assert [commit["id"] for commit in saved_commits] == ["commit2", "commit1"]
+    assert saved_commits[1]["message"] == "First commit"
+
+def test_get_existing_commit_ids(neo4j_connection, mock_repo_url, mock_commits):
+    """测试批量查询已存在的提交"""
+    neo4j_connection.save_commits(mock_repo_url, mock_commits)
+
+    existing = neo4j_connection.get_existing_commit_ids(
+        mock_repo_url,
+        ["commit1", "commit2", "commit3"]
+    )
+    assert existing == {"commit1", "commit2"}
+    assert neo4j_connection.get_existing_commit_ids("https://example.com/other.git", ["commit1"]) == set()
+
+def test_get_synced_commit_ids(neo4j_connection, mock_repo_url, mock_commits):
+    """测试只有同步历史保存的提交才算已同步"""
+    neo4j_connection.save_commits(mock_repo_url, mock_commits[1:])
+    assert neo4j_connection.get_synced_commit_ids(mock_repo_url, ["commit2"]) == set()
+
+    neo4j_connection.save_commits(mock_repo_url, mock_commits, synced=True)
+    assert neo4j_connection.get_synced_commit_ids(mock_repo_url, ["commit1", "commit2"]) == {"commit1", "commit2"}
+    # 之后查询接口再次保存时不清除已同步的标记
+    neo4j_connection.save_commits(mock_repo_url, mock_commits[1:])
+    assert neo4j_connection.get_synced_commit_ids(mock_repo_url, ["commit2"]) == {"commit2"}
+
+def test_delete_repository_returns_commit_count(neo4j_connection, mock_repo_url, mock_commits):
+    """测试删除仓库时返回被删除的提交数量"""
+    neo4j_connection.save_commits(mock_repo_url, mock_commits)
+
+    assert neo4j_connection.delete_repository(mock_repo_url) == 2
+    assert neo4j_connection.get_commit_by_id(mock_repo_url, "commit1") is None
+    assert neo4j_connection.delete_repository(mock_repo_url) == 0
+
+def test_query_services_share_driver():
+    """测试未指定驱动的查询服务复用同一个共享驱动"""
+    with GitQueryService() as first:
+        driver = first.db._driver
+    # 服务退出时不会关闭共享驱动
+    with GitQueryService() as second:
+        assert second.db._driver is driver
+        assert second.db.get_commit_by_id("https://example.com/none.git", "none") is None
@@ -1,6 +1,12 @@
 import pytest
+from git_query import git_operations
 from git_query.git_operations import GitOperations
+from git_query.query import GitQueryService
+from concurrent.futures import ThreadPoolExecutor
+import gc
 import os
+import shutil
+import pygit2
 from unittest.mock import patch, MagicMock
 
 def test_git_token_auth():
@@ -36,4 +42,294 @@ def test_private_repo_access():
         repo = git_ops._clone_repository(private_repo_url)
         assert repo is not None
     except Exception as e:
-        pytest.fail(f"使用token克隆私有仓库失败: {str(e)}") 
\ No newline at end of file
+        pytest.fail(f"使用token克隆私有仓库失败: {str(e)}") 
+
+@pytest.fixture(autouse=True)
+def repo_cache_root(tmp_path, monkeypatch):
+    """将仓库缓存目录指向临时目录"""
+    cache_root = tmp_path / 'cache'
+    monkeypatch.setattr(git_operations, 'CACHE_ROOT', cache_root)
+    return cache_root
+
+@pytest.fixture
+def local_repo(tmp_path):
+    """
+    构造一个带合并提交的本地仓库::
+
+        a - b - d ------ m1 - e - m2 - f
+             \\         /         /
+              s1 - s2          /
+             \\                 /
+              t1 --------------
+
+    b 打 tag v0，d 打 tag v1，f 打 tag v2
+    """
+    repo = pygit2.init_repository(str(tmp_path / 'src'), bare=True)
+    tree = repo.TreeBuilder().write()
+    ids = {}
+
+    def commit(name, parents, timestamp):
+        sig = pygit2.Signature('Test Author', 'test@example.com', timestamp, 0)
+        ids[name] = repo.create_commit(
+            None, sig, sig, name, tree, [ids[p] for p in parents]
+        )
+
+    commit('a', [], 1)
+    commit('b', ['a'], 2)
+    commit('s1', ['b'], 3)
+    commit('d', ['b'], 4)
+    commit('s2', ['s1'], 5)
+    commit('m1', ['d', 's2'], 6)
+    commit('e', ['m1'], 7)
+    commit('t1', ['b'], 8)
+    commit('m2', ['e', 't1'], 9)
+    commit('f', ['m2'], 10)
+
+    repo.create_reference('refs/heads/master', ids['f'])
+    repo.create_reference('refs/tags/v0', ids['b'])
+    repo.create_reference('refs/tags/v1', ids['d'])
+    repo.create_reference('refs/tags/v2', ids['f'])
+    return str(tmp_path / 'src')
+
+def test_get_commits_between_includes_merged_branches(local_repo):
+    """测试获取两个引用之间的提交时包含合并进来的分支"""
+    git_ops = GitOperations()
+    commits = git_ops.get_commits_between(local_repo, 'v2', 'v0')
+
+    depths = {commit['message']: commit['depth'] for commit in commits}
+    assert depths == {
+        'f': 0, 'm2': 1, 'e': 2, 't1': 2, 'm1': 3,
+        'b': 3, 'd': 4, 's2': 4, 's1': 5,
+    }
+    assert commits[0]['message'] == 'f'
+    assert [commit['depth'] for commit in commits] == sorted(depths.values())
+
+def test_get_commits_between_excludes_end_ancestors(local_repo):
+    """测试结果中不包含目标提交的祖先"""
+    git_ops = GitOperations()
+    commits = git_ops.get_commits_between(local_repo, 'v2', 'v1')
+
+    messages = {commit['message'] for commit in commits}
+    assert 'd' in messages
+    assert messages.isdisjoint({'a', 'b'})
+
+def test_get_commits_between_unrelated_end(local_repo):
+    """测试目标提交不是起始提交的祖先"""
+    git_ops = GitOperations()
+    with pytest.raises(ValueError):
+        git_ops.get_commits_between(local_repo, 'v1', 'v2')
+
+def test_clone_repository_reuses_cache(local_repo, repo_cache_root):
+    """测试不同实例克隆同一仓库时复用缓存"""
+    repo = GitOperations()._clone_repository(local_repo)
+    assert GitOperations()._clone_repository(local_repo) is repo
+    assert len(list(repo_cache_root.iterdir())) == 1
+
+def test_iter_commit_batches_stops_at_known_commits(local_repo):
+    """测试分批遍历时不再追溯已知提交的祖先"""
+    git_ops = GitOperations()
+    repo = git_ops._clone_repository(local_repo)
+    start_id = str(git_ops._get_commit_object(repo, 'v2').id)
+    known_ids = {str(git_ops._get_commit_object(repo, 'v0').id)}
+
+    batches = list(git_ops.iter_commit_batches(repo, start_id, 3, known_ids))
+
+    assert [len(batch) for batch in batches] == [3, 3, 2]
+    messages = {commit['message'] for batch in batches for commit in batch}
+    assert messages == {'f', 'm2', 'e', 't1', 'm1', 'd', 's2', 's1'}
+
+def test_iter_commit_batches_shortest_depths(local_repo):
+    """测试提交时间早于子提交时，分批遍历返回到起始提交的最短距离"""
+    git_ops = GitOperations()
+    repo = git_ops._clone_repository(local_repo)
+    start_id = str(git_ops._get_commit_object(repo, 'v2').id)
+
+    depths = {
+        commit['message']: commit['depth']
+        for batch in git_ops.iter_commit_batches(repo, start_id, 4)
+        for commit in batch
+    }
+    assert depths == {
+        'f': 0, 'm2': 1, 'e': 2, 't1': 2, 'm1': 3,
+        'b': 3, 'd': 4, 's2': 4, 's1': 5, 'a': 4,
+    }
+
+def test_get_commits_by_depth_without_shallow_support(local_repo):
+    """测试传输方式不支持浅克隆时退回完整克隆"""
+    git_ops = GitOperations()
+    commits = git_ops.get_commits_by_depth(local_repo, 'v2', 1)
+
+    assert [commit['message'] for commit in commits] == ['f', 'm2']
+    assert len(commits[1]['parents']) == 2
+    assert local_repo not in git_operations._repo_depths
+
+def test_clone_repository_writes_commit_graph(local_repo):
+    """测试完整克隆后生成 commit-graph 文件"""
+    repo = GitOperations()._clone_repository(local_repo)
+    assert os.path.exists(os.path.join(repo.path, 'objects', 'info', 'commit-graph'))
+
+def test_clone_repository_reuses_disk_cache(local_repo, repo_cache_root, monkeypatch):
+    """测试进程内缓存为空时复用磁盘上已有的克隆"""
+    repo = GitOperations()._clone_repository(local_repo)
+    marker = os.path.join(repo.path, 'marker')
+    open(marker, 'w').close()
+
+    monkeypatch.setattr(git_operations, '_repo_cache', git_operations.OrderedDict())
+    reopened = GitOperations()._clone_repository(local_repo)
+
+    assert reopened.path == repo.path
+    assert os.path.exists(marker)
+
+def test_clone_repository_evicts_least_recently_used(local_repo, repo_cache_root, monkeypatch, tmp_path):
+    """测试超出缓存容量时删除最久未使用仓库的目录"""
+    other_repo = str(tmp_path / 'other')
+    shutil.copytree(local_repo, other_repo)
+    monkeypatch.setattr(git_operations, 'REPO_CACHE_SIZE', 1)
+
+    first = GitOperations()._clone_repository(local_repo)
+    first_path = first.path
+    GitOperations()._clone_repository(other_repo)
+    # 已淘汰但仍在使用的仓库保留目录
+    assert os.path.exists(first_path)
+
+    # pygit2 仓库对象与其引用集合之间存在循环引用，由垃圾回收释放
+    del first
+    gc.collect()
+    GitOperations()._clone_repository(other_repo)
+    assert not os.path.exists(first_path)
+    assert len(list(repo_cache_root.iterdir())) == 1
+
+def test_clone_repository_evicts_under_concurrency(local_repo, repo_cache_root, monkeypatch, tmp_path):
+    """测试并发请求交替访问超出缓存容量的仓库时，淘汰不会删除正在使用的仓库"""
+    urls = [local_repo]
+    for i in range(2):
+        urls.append(str(tmp_path / f'copy{i}'))
+        shutil.copytree(local_repo, urls[-1])
+    monkeypatch.setattr(git_operations, 'REPO_CACHE_SIZE', 1)
+
+    def query(i):
+        return len(GitOperations().get_commits_between(urls[i % len(urls)], 'v2', 'v0'))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert set(pool.map(query, range(60))) == {9}
+
+    # 请求全部结束、仓库对象被回收后，只保留缓存中仓库的目录
+    gc.collect()
+    GitOperations()._remove_evicted_repositories()
+    assert len(list(repo_cache_root.iterdir())) == 1
+
+def test_clone_repository_fetches_once_per_instance(local_repo, monkeypatch):
+    """测试同一实例多次获取同一仓库时只拉取一次"""
+    git_ops = GitOperations()
+    repo = git_ops._clone_repository(local_repo)
+
+    fetch = MagicMock(side_effect=AssertionError("不应再次拉取"))
+    monkeypatch.setattr(git_ops, '_fetch', fetch)
+    assert git_ops._clone_repository(local_repo) is repo
+    assert git_ops._clone_repository(local_repo, depth=3) is repo
+
+def test_get_first_commit(local_repo):
+    """测试获取仓库的第一个提交"""
+    commit = GitOperations().get_first_commit(local_repo)
+    assert commit['message'] == 'a'
+    assert commit['parents'] == []
+    assert commit['depth'] == 0
+
+def test_get_first_commit_without_git(local_repo, monkeypatch):
+    """测试 git 命令不可用时遍历提交查找第一个提交"""
+    monkeypatch.setattr(GitOperations, '_get_root_commit_id', staticmethod(lambda repo: None))
+    commit = GitOperations().get_first_commit(local_repo)
+    assert commit['message'] == 'a'
+
+def test_commits_share_author_strings(local_repo):
+    """测试同一作者的提交共用作者名字符串"""
+    commits = GitOperations().get_commits_by_depth(local_repo, 'v2', 3)
+    assert len({id(commit['author']) for commit in commits}) == 1
+
+def test_get_commit_object_resolves_refs(local_repo):
+    """测试解析标签、分支、commit id 和无效引用"""
+    git_ops = GitOperations()
+    repo = git_ops._clone_repository(local_repo)
+
+    tagged = git_ops._get_commit_object(repo, 'v1')
+    assert tagged.message == 'd'
+    assert git_ops._get_commit_object(repo, 'master').message == 'f'
+    assert git_ops._get_commit_object(repo, 'refs/tags/v0').message == 'b'
+    assert git_ops._get_commit_object(repo, str(tagged.id)).id == tagged.id
+
+    with pytest.raises(ValueError, match='missing'):
+        git_ops._get_commit_object(repo, 'missing')
+
+def test_clone_repository_fetches_after_interval(local_repo, monkeypatch):
+    """测试超过拉取间隔后再次拉取"""
+    git_ops = GitOperations()
+    git_ops._clone_repository(local_repo)
+
+    monkeypatch.setattr(git_operations, 'FETCH_INTERVAL', 0)
+    fetch = MagicMock(side_effect=lambda repo, fetch_depth: fetch_depth)
+    monkeypatch.setattr(git_ops, '_fetch', fetch)
+    git_ops._clone_repository(local_repo)
+    fetch.assert_called_once()
+
+def test_open_refs_fetches_missing_ref(local_repo):
+    """测试拉取间隔内找不到引用时立即拉取后重试"""
+    git_ops = GitOperations()
+    git_ops._clone_repository(local_repo)
+
+    source = pygit2.Repository(local_repo)
+    source.create_reference('refs/tags/v3', source.references['refs/tags/v1'].target)
+    repo, (start, end) = git_ops._open_refs(local_repo, ('v3', 'v0'))
+    assert start.message == 'd'
+    assert end.message == 'b'
+
+    # 拉取后仍不存在的引用不会反复拉取
+    fetch = MagicMock(side_effect=lambda repo, fetch_depth: fetch_depth)
+    with patch.object(git_ops, '_fetch', fetch):
+        with pytest.raises(ValueError, match='missing'):
+            git_ops._open_refs(local_repo, ('missing',))
+    fetch.assert_called_once()
+
+def test_shared_instance_concurrent_queries(local_repo, monkeypatch):
+    """测试工厂复用的同一实例被多个线程同时使用，并且每次都拉取更新时结果正确"""
+    monkeypatch.setattr(git_operations, 'FETCH_INTERVAL', 0)
+    git_ops = GitOperations()
+
+    def query(_):
+        return len(git_ops.get_commits_between(local_repo, 'v2', 'v0'))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert set(pool.map(query, range(40))) == {9}
+
+def test_clone_repository_skips_fetch_for_known_commit_ids(local_repo, monkeypatch):
+    """测试需要的commit id已存在于本地时不拉取更新"""
+    git_ops = GitOperations()
+    repo = git_ops._clone_repository(local_repo)
+    commit_id = str(repo.references['refs/tags/v1'].target)
+
+    monkeypatch.setattr(git_operations, 'FETCH_INTERVAL', 0)
+    fetch = MagicMock(side_effect=AssertionError("不应再次拉取"))
+    monkeypatch.setattr(git_ops, '_fetch', fetch)
+    assert git_ops._clone_repository(local_repo, commit_ids=(commit_id,)) is repo
+    # 另一个实例命中进程内缓存时同样不拉取
+    other = GitOperations()
+    monkeypatch.setattr(other, '_fetch', fetch)
+    assert other._open_ref(local_repo, commit_id)[1].message == 'd'
+
+def test_bulk_get_commits_uses_private_cache(local_repo, repo_cache_root):
+    """测试批量查询在子进程中使用单独的缓存目录，并按规范化的地址去重"""
+    # file URL 支持浅克隆，子进程按深度浅克隆时不能影响这里的完整克隆
+    url = 'file://' + local_repo
+    repo = GitOperations()._clone_repository(url)
+    marker = os.path.join(repo.path, 'marker')
+    open(marker, 'w').close()
+    entries = set(repo_cache_root.iterdir())
+
+    results = GitQueryService().bulk_get_commits(
+        [url, url + '/'], 'v2', 1, max_workers=1
+    )
+
+    assert set(results) == {url, url + '/'}
+    for commits in results.values():
+        assert [commit['message'] for commit in commits] == ['f', 'm2']
+    assert set(repo_cache_root.iterdir()) == entries
+    assert os.path.exists(marker)
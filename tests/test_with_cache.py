@@ -1,11 +1,15 @@
 import pytest
+import time
 from fastapi.testclient import TestClient
 from git_query.api import app
-import json
-from typing import List, Dict
+from git_query.db import GitDatabase
+from git_query.git_operations import GitOperations
+from tests import response_json
 from unittest.mock import patch, MagicMock
-from datetime import datetime
+from neo4j.exceptions import Neo4jError, ServiceUnavailable
 
+# 不使用 conftest 中会话级的 test_client：其启动过程会连接 Neo4j 并初始化约束，
+# 而本模块的测试全部使用模拟对象，属于无需数据库的单元测试；不进入 lifespan 的客户端不会连接数据库
 client = TestClient(app)
 
 # 测试数据
@@ -19,7 +23,7 @@ MOCK_COMMITS = [
         "id": "commit1",
         "message": "First commit",
         "author": "Test Author",
-        "time": int(datetime.now().timestamp()),
+        "time": 1234567890,
         "parents": [],
         "depth": 0
     },
@@ -27,34 +31,77 @@ MOCK_COMMITS = [
         "id": "commit2",
         "message": "Second commit",
         "author": "Test Author",
-        "time": int(datetime.now().timestamp()),
+        "time": 1234567891,
         "parents": ["commit1"],
         "depth": 1
     }
 ]
 
 
+def wait_until(predicate, timeout=5):
+    """轮询等待条件成立，超时后测试失败，避免无限等待"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            pytest.fail("等待条件成立超时")
+        time.sleep(0.001)
+
+def miss_then(result):
+    """第一次调用返回空列表，之后每次调用都返回 result"""
+    called = False
+
+    def side_effect(*args, **kwargs):
+        nonlocal called
+        if not called:
+            called = True
+            return []
+        return result
+    return side_effect
+
+@pytest.fixture(scope="module")
+def patched_git_operations():
+    """整个模块只替换一次git操作工厂，模拟对象限定为 GitOperations 已有的属性"""
+    with patch('git_query.query.GitOperationsFactory') as mock:
+        mock.create.return_value = MagicMock(spec=GitOperations)
+        yield mock.create.return_value
+
+@pytest.fixture(scope="module")
+def patched_db():
+    """整个模块只替换一次数据库类，模拟对象限定为 GitDatabase 已有的属性"""
+    with patch('git_query.query.GitDatabase') as mock:
+        mock.return_value = MagicMock(spec=GitDatabase)
+        yield mock.return_value
+
 @pytest.fixture
-def mock_git_operations():
-    with patch('git_query.query.GitOperations') as mock:
-        ops = mock.return_value
-        # 模拟克隆仓库
-        ops._clone_repository.return_value = MagicMock()
-        # 模拟获取commit对象
-        ops._get_commit_object.return_value = MagicMock(id='commit1')
-        # 模拟获取提交
-        ops.get_commits_between.return_value = MOCK_COMMITS
-        ops.get_commits_by_depth.return_value = MOCK_COMMITS
-        yield ops
+def mock_git_operations(patched_git_operations):
+    ops = patched_git_operations
+    # 清除上一个测试设置的返回值和调用记录
+    ops.reset_mock(return_value=True, side_effect=True)
+    # 模拟克隆仓库
+    ops._clone_repository.return_value = MagicMock()
+    # 模拟获取commit对象
+    ops._get_commit_object.return_value = MagicMock(id='commit1')
+    ops._open_ref.return_value = (MagicMock(), MagicMock(id='commit1'))
+    ops._open_refs.return_value = (MagicMock(), [MagicMock(id='commit1'), MagicMock(id='commit0')])
+    # 模拟获取提交
+    ops._get_commits_between_ids.return_value = MOCK_COMMITS
+    ops.get_commits_by_depth.return_value = MOCK_COMMITS
+    return ops
+
+@pytest.fixture(autouse=True)
+def clear_commit_cache():
+    """每个测试前清空单个提交查询的缓存"""
+    from git_query import query
+    query._commit_cache.clear()
 
 @pytest.fixture
-def mock_db():
-    with patch('git_query.query.GitDatabase') as mock:
-        db = mock.return_value
-        # 第一次查询返回空（模拟缓存未命中）
-        db.get_commits_between.side_effect = [[], MOCK_COMMITS]
-        db.get_commits_by_depth.side_effect = [[], MOCK_COMMITS]
-        yield db
+def mock_db(patched_db):
+    db = patched_db
+    db.reset_mock(return_value=True, side_effect=True)
+    # 第一次查询返回空（模拟缓存未命中）
+    db.get_commits_between.side_effect = miss_then(MOCK_COMMITS)
+    db.get_commits_by_depth.side_effect = miss_then(MOCK_COMMITS)
+    return db
 
 def test_get_commits_between_with_cache(mock_git_operations, mock_db):
     """测试获取提交时的缓存机制"""
@@ -65,26 +112,24 @@ def test_get_commits_between_with_cache(mock_git_operations, mock_db):
     # 第一次请求（缓存未命中）
     response1 = client.get(f"/commits/?repo_url={repo_url}&start_ref={start_ref}&end_ref={end_ref}")
     assert response1.status_code == 200
-    result1 = response1.json()
 
     # 验证 Git 操作被调用
-    mock_git_operations.get_commits_between.assert_called_once()
+    mock_git_operations._get_commits_between_ids.assert_called_once()
     # 验证数据被保存到数据库
     mock_db.save_commits.assert_called_once()
 
     # 重置计数器
-    mock_git_operations.get_commits_between.reset_mock()
+    mock_git_operations._get_commits_between_ids.reset_mock()
     mock_db.save_commits.reset_mock()
 
     # 第二次请求（应该命中缓存）
     response2 = client.get(f"/commits/?repo_url={repo_url}&start_ref={start_ref}&end_ref={end_ref}")
     assert response2.status_code == 200
-    result2 = response2.json()
 
-    # 验证结果一致
-    assert result1 == result2
+    # 验证结果一致，直接比较响应内容，无需解析 JSON
+    assert response1.content == response2.content
     # 验证没有再次调用 Git 操作
-    mock_git_operations.get_commits_between.assert_not_called()
+    mock_git_operations._get_commits_between_ids.assert_not_called()
     # 验证没有再次保存到数据库
     mock_db.save_commits.assert_not_called()
 
@@ -99,7 +144,6 @@ def test_get_commits_by_depth_with_cache(mock_git_operations, mock_db):
     # 第一次请求（缓存未命中）
     response1 = client.post("/commits/by-depth", json=request_data)
     assert response1.status_code == 200
-    result1 = response1.json()
 
     # 验证 Git 操作被调用
     mock_git_operations.get_commits_by_depth.assert_called_once()
@@ -113,10 +157,9 @@ def test_get_commits_by_depth_with_cache(mock_git_operations, mock_db):
     # 第二次请求（应该命中缓存）
     response2 = client.post("/commits/by-depth", json=request_data)
     assert response2.status_code == 200
-    result2 = response2.json()
 
-    # 验证结果一致
-    assert result1 == result2
+    # 验证结果一致，直接比较响应内容，无需解析 JSON
+    assert response1.content == response2.content
     # 验证没有再次调用 Git 操作
     mock_git_operations.get_commits_by_depth.assert_not_called()
     # 验证没有再次保存到数据库
@@ -129,14 +172,230 @@ def test_database_fallback(mock_git_operations, mock_db):
     end_ref = "v1.0.0"
 
     # 模拟数据库查询抛出异常
-    mock_db.get_commits_between.side_effect = Exception("Database error")
+    mock_db.get_commits_between.side_effect = Neo4jError("Database error")
 
     # 发送请求
     response = client.get(f"/commits/?repo_url={repo_url}&start_ref={start_ref}&end_ref={end_ref}")
     assert response.status_code == 200
 
     # 验证直接使用了 Git 操作
-    mock_git_operations.get_commits_between.assert_called_once()
+    mock_git_operations._get_commits_between_ids.assert_called_once()
     # 验证没有尝试保存到数据库（因为数据库已经失败）
     mock_db.save_commits.assert_not_called()
 
+
+def test_get_commits_between_commit_ids_skip_git(mock_git_operations, mock_db):
+    """测试使用完整commit id且数据库命中时不访问git仓库"""
+    mock_db.get_commits_between.side_effect = None
+    mock_db.get_commits_between.return_value = MOCK_COMMITS
+
+    response = client.get(
+        "/commits/",
+        params={
+            "repo_url": "https://github.com/test/repo.git",
+            "start_ref": "a" * 40,
+            "end_ref": "b" * 40
+        }
+    )
+    assert response.status_code == 200
+    assert response_json(response) == MOCK_COMMITS
+    mock_git_operations._open_refs.assert_not_called()
+
+def test_sync_commit_history_accumulates_batches(mock_git_operations, mock_db):
+    """测试同步历史时累积多个遍历批次后一次写入"""
+    from git_query.query import GitQueryService
+
+    mock_db.get_synced_commit_ids.return_value = set()
+    mock_git_operations.iter_commit_batches.return_value = iter([MOCK_COMMITS[1:], MOCK_COMMITS[:1]])
+
+    with GitQueryService() as query_service:
+        total = query_service.sync_commit_history("https://github.com/test/repo.git", "commit2", 1)
+
+    assert total == 2
+    mock_db.save_commits.assert_called_once()
+    assert mock_db.save_commits.call_args.args[:2] == (
+        "https://github.com/test/repo.git",
+        MOCK_COMMITS[1:] + MOCK_COMMITS[:1]
+    )
+    assert mock_db.save_commits.call_args.kwargs == {"synced": True}
+
+def test_sync_commit_history_already_synced(mock_git_operations, mock_db):
+    """测试起始提交已同步时不访问git仓库"""
+    from git_query.query import GitQueryService
+
+    mock_db.get_synced_commit_ids.return_value = {"commit2"}
+    with GitQueryService() as query_service:
+        assert query_service.sync_commit_history("https://github.com/test/repo.git", "commit2") == 0
+
+    mock_db.get_synced_commit_ids.assert_called_once()
+    assert mock_db.get_synced_commit_ids.call_args.args == ("https://github.com/test/repo.git", ["commit2"])
+    mock_db.get_commit_by_id.assert_not_called()
+    mock_git_operations._clone_repository.assert_not_called()
+
+def test_get_commit_by_id_from_git(mock_git_operations, mock_db):
+    """测试数据库中不存在时从git读取单个提交"""
+    from git_query.query import GitQueryService
+    from pygit2.enums import ObjectType
+
+    commit_obj = MagicMock(
+        id="commit2",
+        message="Second commit",
+        commit_time=MOCK_COMMITS[1]["time"],
+        parent_ids=["commit1"]
+    )
+    commit_obj.author.name = "Test Author"
+    commit_obj.type = ObjectType.COMMIT
+    mock_git_operations._clone_repository.return_value.get.return_value = commit_obj
+    mock_db.get_commit_by_id.return_value = None
+
+    with GitQueryService() as query_service:
+        commit = query_service.get_commit_by_id("https://github.com/test/repo.git", "commit2")
+
+    assert commit == {**MOCK_COMMITS[1], "depth": 0}
+    mock_db.save_commits.assert_called_once()
+
+def test_get_commit_by_id_cached(mock_git_operations, mock_db):
+    """测试单个提交查询命中缓存，删除仓库后失效"""
+    from git_query.query import GitQueryService
+
+    repo_url = "https://github.com/test/repo.git"
+    mock_db.get_commit_by_id.return_value = MOCK_COMMITS[0]
+    mock_db.delete_repository.return_value = 1
+
+    with GitQueryService() as query_service:
+        first = query_service.get_commit_by_id(repo_url, "commit1")
+        first["parents"].append("changed")
+        assert query_service.get_commit_by_id(repo_url, "commit1") == MOCK_COMMITS[0]
+        assert mock_db.get_commit_by_id.call_count == 1
+
+        query_service.delete_repository(repo_url)
+        query_service.get_commit_by_id(repo_url, "commit1")
+        assert mock_db.get_commit_by_id.call_count == 2
+
+def test_query_service_connects_lazily():
+    """测试查询服务在首次访问数据库时才获取驱动"""
+    from git_query.query import GitQueryService
+
+    with patch('git_query.query.GitDatabase') as mock:
+        with GitQueryService() as query_service:
+            mock.get_shared_driver.assert_not_called()
+            query_service.db
+            mock.get_shared_driver.assert_called_once()
+
+def test_get_commits_by_depth_database_unavailable(mock_git_operations, mock_db):
+    """测试数据库不可用时直接使用git的结果且不再同步"""
+    mock_db.get_commits_by_depth.side_effect = ServiceUnavailable("Database down")
+
+    response = client.post("/commits/by-depth", json={
+        "remote_url": "https://github.com/test/repo.git",
+        "start_ref": "main",
+        "max_depth": 2
+    })
+    assert response.status_code == 200
+    mock_git_operations.get_commits_by_depth.assert_called_once()
+    mock_db.save_commits.assert_not_called()
+
+def test_get_commits_by_depth_invalid_ref_not_retried(mock_git_operations, mock_db):
+    """测试引用无效时直接返回错误，不重复执行git操作"""
+    mock_git_operations._open_ref.side_effect = ValueError("Invalid reference")
+
+    response = client.post("/commits/by-depth", json={
+        "remote_url": "https://github.com/test/repo.git",
+        "start_ref": "missing",
+        "max_depth": 2
+    })
+    assert response.status_code == 400
+    mock_git_operations._open_ref.assert_called_once()
+    mock_git_operations.get_commits_by_depth.assert_not_called()
+
+def test_get_commits_between_streams_large_response(mock_git_operations, mock_db):
+    """测试提交较多时分块流式返回完整的 JSON 数组"""
+    commits = [
+        {**MOCK_COMMITS[0], "id": f"commit{i}", "depth": i}
+        for i in range(2500)
+    ]
+    mock_git_operations._get_commits_between_ids.return_value = commits
+
+    response = client.get(
+        "/commits/",
+        params={"repo_url": "https://github.com/test/repo.git", "start_ref": "main", "end_ref": "v1.0.0"}
+    )
+    assert response.status_code == 200
+    assert response_json(response) == commits
+
+def test_get_commits_between_concurrent_requests_walk_once(mock_git_operations, mock_db):
+    """测试相同范围的并发请求只遍历一次git，等待的请求从数据库读取结果"""
+    import threading
+    from git_query import query
+    from git_query.query import GitQueryService
+
+    mock_db.get_commits_between.side_effect = [[], [], MOCK_COMMITS]
+    walking = threading.Event()
+    release = threading.Event()
+
+    def walk(repo, start_commit, end_commit):
+        walking.set()
+        release.wait(5)
+        return MOCK_COMMITS
+    mock_git_operations._get_commits_between_ids.side_effect = walk
+
+    results = []
+    def request():
+        with GitQueryService() as query_service:
+            results.append(query_service.get_commits_between(
+                "https://github.com/test/repo.git", "main", "v1.0.0"
+            ))
+
+    first = threading.Thread(target=request)
+    first.start()
+    assert walking.wait(5)
+    second = threading.Thread(target=request)
+    second.start()
+    # 等待第二个请求进入等待状态后再结束第一个请求的遍历
+    wait_until(lambda: next(iter(query._inflight_ranges.values()))[1] >= 2)
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert results == [MOCK_COMMITS, MOCK_COMMITS]
+    mock_git_operations._get_commits_between_ids.assert_called_once()
+    mock_db.save_commits.assert_called_once()
+    assert not query._inflight_ranges
+
+def test_sync_commit_history_concurrent_requests_sync_once(mock_git_operations, mock_db):
+    """测试同一起点的并发同步只遍历一次git"""
+    import threading
+    from git_query import query
+    from git_query.query import GitQueryService
+
+    synced = set()
+    mock_db.get_synced_commit_ids.side_effect = lambda repo_url, ids, session=None: synced & set(ids)
+    walking = threading.Event()
+    release = threading.Event()
+
+    def batches(*args, **kwargs):
+        walking.set()
+        release.wait(5)
+        yield MOCK_COMMITS[1:] + MOCK_COMMITS[:1]
+    mock_git_operations.iter_commit_batches.side_effect = batches
+    mock_db.save_commits.side_effect = lambda repo_url, commits, session=None, **kwargs: synced.update(
+        commit["id"] for commit in commits
+    )
+
+    results = []
+    def request():
+        with GitQueryService() as query_service:
+            results.append(query_service.sync_commit_history("https://github.com/test/repo.git", "commit2"))
+
+    first = threading.Thread(target=request)
+    first.start()
+    assert walking.wait(5)
+    second = threading.Thread(target=request)
+    second.start()
+    wait_until(lambda: next(iter(query._inflight_ranges.values()))[1] >= 2)
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert sorted(results) == [0, 2]
+    mock_git_operations.iter_commit_batches.assert_called_once()